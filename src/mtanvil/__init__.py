@@ -1,8 +1,23 @@
+import abc
 import sqlite3
 import zstandard as zstd
 import zlib
 import struct
 import io
+import copy
+import hashlib
+import json
+import os
+import mmap
+import pathlib
+import threading
+import time
+import queue
+import concurrent.futures
+import collections
+import math
+import array
+import random
 
 def pop_bytes(data, n):
     if len(data) < n:
@@ -15,8 +30,8 @@ def zstd_decompress(data):
         data = reader.read()
     return data
 
-def zstd_compress(data):
-    compressor = zstd.ZstdCompressor()
+def zstd_compress(data, level=3):
+    compressor = zstd.ZstdCompressor(level=level)
     data = compressor.compress(data)
     return data
 
@@ -43,6 +58,21 @@ def pack(type_name, data):
         raise ValueError("Invalid format")
     return struct.pack(type_to_format[type_name], data)
 
+width_to_format = {
+    1: "B",
+    2: "H"
+}
+
+def unpack_array(width, data):
+    if not width in width_to_format:
+        raise ValueError("Invalid width")
+    return struct.unpack(">" + str(len(data) // width) + width_to_format[width], data)
+
+def pack_array(width, values):
+    if not width in width_to_format:
+        raise ValueError("Invalid width")
+    return struct.pack(">" + str(len(values)) + width_to_format[width], *values)
+
 def pos_get_mapblock(pos):
     return (
         pos[0] // 16,
@@ -57,37 +87,337 @@ def pos_get_node(pos):
         pos[2] % 16,
     )
 
-def is_inventory(data):
-    data = io.BytesIO(data)
-    data.readline() # Initial data
-    
+def normalize_region(region):
+    return (
+        tuple(min(region[0][i], region[1][i]) for i in range(3)),
+        tuple(max(region[0][i], region[1][i]) for i in range(3)),
+    )
+
+def pos_in_region(pos, region):
+    return all(region[0][i] <= pos[i] <= region[1][i] for i in range(3))
+
+def find_inventory_end(data, offset=0):
+    # A serialized inventory has no length prefix, it is a block of text lines ending with "EndInventory".
+    # Only the lines of this inventory are looked at, never the rest of the MapBlock.
+    # "end" closes an open list as well as the inventory, just like in Inventory.parse.
+    in_list = False
     while True:
-        line = data.readline().split(b" ")
-        if line[0] == b"EndInventory\n" or line[0] == b"end":
-            return True
-        elif line[0] == b"Width":
-            pass
-        elif line[0] == b"Item":
-            pass
-        elif line[0] == b"Empty\n":
-            pass
-        elif line[0] == b"EndInventoryList\n":
-            pass
-        else:
-            return False
+        end = data.find(b"\n", offset)
+        if end == -1:
+            raise ValueError("Unterminated inventory in node metadata")
+        line = data[offset:end]
+        offset = end + 1
+        if in_list:
+            if line == b"EndInventoryList" or line == b"end":
+                in_list = False
+        elif line.startswith(b"List "):
+            in_list = True
+        elif line == b"EndInventory" or line == b"end":
+            return offset
 
 def extract_inventory(data):
-    pos = data.find(b'EndInventory\n')
-    if pos > -1:
-        inventory, data = pop_bytes(data, pos+len(b'EndInventory\n'))
-        return inventory, data
-    return None, data
+    return pop_bytes(data, find_inventory_end(data))
+
+def split_itemstring(itemstring):
+    # Fields are separated by spaces, but JSON-quoted fields (e.g. item metadata) may contain spaces
+    fields = []
+    i = 0
+    while i < len(itemstring):
+        if itemstring[i] == " ":
+            i += 1
+            continue
+        start = i
+        if itemstring[i] == '"':
+            i += 1
+            while i < len(itemstring) and itemstring[i] != '"':
+                if itemstring[i] == "\\":
+                    i += 1
+                i += 1
+            i += 1
+        else:
+            while i < len(itemstring) and itemstring[i] != " ":
+                i += 1
+        fields.append(itemstring[start:i])
+    return fields
+
+class ItemStack:
+    def __init__(self, name="", count=1, wear=0, metadata=""):
+        self.name = name
+        self.count = count
+        self.wear = wear
+        self.metadata = metadata # Kept in its serialized (possibly JSON-quoted) form
+
+    @classmethod
+    def from_string(cls, itemstring):
+        fields = split_itemstring(itemstring)
+        stack = cls(fields[0] if fields else "")
+        if len(fields) > 1:
+            stack.count = int(fields[1])
+        if len(fields) > 2:
+            stack.wear = int(fields[2])
+        if len(fields) > 3:
+            stack.metadata = " ".join(fields[3:])
+        return stack
+
+    def to_string(self):
+        # Trailing default fields are left out, the same way Luanti does it
+        fields = [self.name, str(self.count), str(self.wear), self.metadata]
+        if self.metadata:
+            parts = 4
+        elif self.wear != 0:
+            parts = 3
+        elif self.count != 1:
+            parts = 2
+        else:
+            parts = 1
+        return " ".join(fields[:parts])
+
+    def __repr__(self):
+        return f"ItemStack({self.to_string()!r})"
+
+class InventoryList:
+    def __init__(self, name, size=0, width=0, items=None):
+        self.name = name
+        self.size = size
+        self.width = width
+        self.items = items if items is not None else [None] * size # None is an empty slot
+
+    def serialize(self):
+        lines = [f"List {self.name} {self.size}", f"Width {self.width}"]
+        for item in self.items:
+            if item is None or not item.name:
+                lines.append("Empty")
+            else:
+                lines.append("Item " + item.to_string())
+        lines.append("EndInventoryList")
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+class Inventory:
+    def __init__(self, raw=None):
+        self.raw = raw
+        self.parsed = None
+
+    @property
+    def lists(self):
+        # Decoded on first access; until then the raw bytes are written back untouched
+        if self.parsed is None:
+            self.parsed = self.parse(self.raw)
+        return self.parsed
+
+    def get_list(self, name):
+        return self.lists.get(name)
+
+    def is_empty(self):
+        if self.parsed is None:
+            return not self.raw or self.raw in (b"EndInventory\n", b"end\n")
+        return not self.parsed
+
+    def parse(self, data=None):
+        lists = {}
+        if not data:
+            return lists
+
+        current = None
+        for line in data.decode("utf-8").split("\n"):
+            if current is not None:
+                if line.startswith("Width "):
+                    current.width = int(line[6:])
+                elif line.startswith("Item "):
+                    current.items.append(ItemStack.from_string(line[5:]))
+                elif line == "Empty":
+                    current.items.append(None)
+                elif line == "EndInventoryList" or line == "end":
+                    current.size = max(current.size, len(current.items))
+                    current.items.extend([None] * (current.size - len(current.items)))
+                    lists[current.name] = current
+                    current = None
+                else:
+                    raise ValueError(f"Unknown line in inventory list: {line!r}")
+            elif line.startswith("List "):
+                fields = line.split(" ")
+                current = InventoryList(fields[1], size=int(fields[2]) if len(fields) > 2 else 0, items=[])
+            elif line == "EndInventory" or line == "end":
+                break
+            elif line.startswith("KeepList ") or line == "":
+                pass
+            else:
+                raise ValueError(f"Unknown line in inventory: {line!r}")
+
+        return lists
+
+    def serialize(self):
+        if self.parsed is None:
+            return self.raw or b"EndInventory\n"
+        data = bytearray()
+        for inventory_list in self.parsed.values():
+            data.extend(inventory_list.serialize())
+        data.extend(b"EndInventory\n")
+        return bytes(data)
+
+def peek_mapblock(data, params=True):
+    # Decodes only the header, name-ID mappings and param arrays of a format 29+ MapBlock,
+    # which is enough to decide whether a block is interesting without building any Nodes.
+    # With params=False the param arrays are skipped as well.
+    version = data[0]
+    if version < 29:
+        return None
+
+    try:
+        body = zstd_decompress(data[1:])
+    except zstd.backend_c.ZstdError:
+        body = data[1:]
+
+    offset = 1 + 2 + 4 + 1 # flags, lighting_complete, timestamp, name_id_mapping_version
+    num_name_id_mappings = struct.unpack_from(">H", body, offset)[0]
+    offset += 2
+
+    name_id_mappings = {}
+    for _ in range(num_name_id_mappings):
+        mapping_id, name_len = struct.unpack_from(">HH", body, offset)
+        offset += 4
+        name_id_mappings[mapping_id] = body[offset:offset + name_len].decode("utf-8")
+        offset += name_len
+
+    content_width, params_width = struct.unpack_from(">BB", body, offset)
+    offset += 2
+    if content_width not in (1, 2) or params_width != 2:
+        return None
+
+    param0 = param1 = param2 = None
+    if params:
+        param0 = struct.unpack_from(">4096" + ("H" if content_width == 2 else "B"), body, offset)
+        param1 = body[offset + 4096 * content_width:offset + 4096 * content_width + 4096]
+        param2 = body[offset + 4096 * content_width + 4096:offset + 4096 * content_width + 8192]
+    offset += 4096 * content_width + 8192
+
+    return {
+        "version": version, "name_id_mappings": name_id_mappings,
+        "param0": param0, "param1": param1, "param2": param2,
+        "node_metadata_version": body[offset],
+        "body": body, "node_metadata_offset": offset
+    }
+
+def is_pristine(data, mapgen_nodes):
+    # True if the block has only mapgen nodes in its palette and no metadata, static objects or timers,
+    # i.e. it was generated but never changed. Only the header is looked at.
+    peek = peek_mapblock(data, params=False)
+    if peek is None:
+        return False # Older formats are always kept
+    if not set(peek["name_id_mappings"].values()) <= mapgen_nodes:
+        return False
+
+    body = peek["body"]
+    offset = peek["node_metadata_offset"]
+    if body[offset] != 0: # node_metadata_version is 0 when there is no metadata
+        return False
+    offset += 2 # node_metadata_version, static_object_version
+    if struct.unpack_from(">H", body, offset)[0] != 0:
+        return False
+    offset += 3 # static_object_count, length_of_single_timer
+    return struct.unpack_from(">H", body, offset)[0] == 0
+
+def read_params(data):
+    # param0, param1 and param2 arrays and the ID -> name mapping of a block, from the header alone where possible
+    peek = peek_mapblock(data)
+    if peek is not None:
+        return peek["param0"], peek["param1"], peek["param2"], peek["name_id_mappings"]
+
+    node_data = MapBlock(data=data, verbose=False).get_node_data(copy=False)
+    name_ids = {}
+    param0 = tuple(name_ids.setdefault(node["name"], len(name_ids)) for node in node_data)
+    param1 = bytes(node["param1"] for node in node_data)
+    param2 = bytes(node["param2"] for node in node_data)
+    return param0, param1, param2, {mapping_id: name for name, mapping_id in name_ids.items()}
+
+def read_timestamp(data):
+    if data[0] >= 29:
+        # Only the first few bytes of the zstd stream are decompressed
+        try:
+            with zstd.ZstdDecompressor().stream_reader(io.BytesIO(data[1:])) as reader:
+                header = reader.read(7)
+        except zstd.backend_c.ZstdError:
+            header = data[1:8]
+        return unpack("u32", header[3:7])
+    return MapBlock(data=data, verbose=False).data["timestamp"]
+
+def skip_node_metadata(body, offset, positions=None):
+    # Walks over the node metadata starting at its version byte and returns the offset after it.
+    # If positions is given, the position of every entry that has vars or a non-empty inventory is added to it.
+    node_metadata_version = body[offset]
+    offset += 1
+    if node_metadata_version == 0:
+        return offset
+
+    num_node_metadata = struct.unpack_from(">H", body, offset)[0]
+    offset += 2
+    for _ in range(num_node_metadata):
+        position, num_vars = struct.unpack_from(">HI", body, offset)
+        offset += 6
+        for _ in range(num_vars):
+            offset += 2 + struct.unpack_from(">H", body, offset)[0]
+            offset += 4 + struct.unpack_from(">I", body, offset)[0]
+            if node_metadata_version == 2:
+                offset += 1
+        inventory_start = offset
+        offset = find_inventory_end(body, offset)
+        if positions is not None and (num_vars or not Inventory(body[inventory_start:offset]).is_empty()):
+            positions.add(position)
+    return offset
+
+def skip_static_objects(body, offset):
+    offset += 1 # static_object_version
+    static_object_count = struct.unpack_from(">H", body, offset)[0]
+    offset += 2
+    for _ in range(static_object_count):
+        offset += 15 + struct.unpack_from(">H", body, offset + 13)[0]
+    return offset
+
+def read_sparse_positions(peek):
+    # Indices of the nodes with metadata and of the nodes with timers, read from a peek_mapblock result
+    # by skipping over everything else
+    body = peek["body"]
+    metadata_positions = set()
+    offset = skip_node_metadata(body, peek["node_metadata_offset"], metadata_positions)
+    offset = skip_static_objects(body, offset)
+
+    timer_length, num_of_timers = struct.unpack_from(">BH", body, offset)
+    offset += 3
+    timer_positions = set()
+    for _ in range(num_of_timers):
+        timer_positions.add(struct.unpack_from(">H", body, offset)[0])
+        offset += timer_length
+    return metadata_positions, timer_positions
+
+def read_static_objects(data):
+    # Skips straight over the node data and metadata to the static objects, without parsing the rest of the block
+    peek = peek_mapblock(data)
+    if peek is None:
+        return MapBlock(data=data, verbose=False).data["static_objects"]
+
+    body = peek["body"]
+    offset = skip_node_metadata(body, peek["node_metadata_offset"])
+
+    offset += 1 # static_object_version
+    static_object_count = struct.unpack_from(">H", body, offset)[0]
+    offset += 2
+
+    static_objects = []
+    for _ in range(static_object_count):
+        object_type, pos_x, pos_y, pos_z, data_size = struct.unpack_from(">BiiiH", body, offset)
+        offset += 15
+        static_objects.append(StaticObject(object_type, (pos_x/10000, pos_y/10000, pos_z/10000), body[offset:offset + data_size]))
+        offset += data_size
+
+    return static_objects
+
+def index_to_pos(index):
+    return (index % 16, (index // 16) % 16, index // 256)
 
 class Node:
     def __init__(self, data=None):
         self.pos = None
         self.raw = data
-        self.data = data or {"name": "ignore", "param1": 0, "param2": 0, "metadata": [], "timers": []}
+        self.data = data or {"name": "ignore", "param1": 0, "param2": 0, "metadata": [], "inventory": None, "timers": []}
 
     def set_name(self, name):
         self.data["name"] = name
@@ -98,12 +428,133 @@ class Node:
     def set_param2(self, param2):
         self.data["param2"] = param2
 
+def has_node_metadata(data):
+    inventory = data.get("inventory")
+    return bool(data["metadata"]) or (inventory is not None and not inventory.is_empty())
+
+def copy_node_data(data):
+    inventory = data.get("inventory")
+    return dict(
+        data,
+        metadata=[dict(var) for var in (data["metadata"] or [])],
+        inventory=Inventory(inventory.serialize()) if inventory is not None else None,
+        timers=[dict(timer) for timer in data["timers"]]
+    )
+
+class NodeList:
+    # The 4096 nodes of a MapBlock. Node objects are only created when a node is accessed, as a copy of
+    # the shared base data, so the base can be shared between MapBlocks (copy-on-write). A uniform block
+    # (e.g. all air) keeps a single node dict as its base.
+    __slots__ = ("base", "uniform", "nodes")
+
+    def __init__(self, base, uniform=False):
+        self.base = base
+        self.uniform = uniform
+        self.nodes = {}
+
+    def base_data(self, index):
+        if self.uniform:
+            return self.base
+        return self.base[index]
+
+    def __len__(self):
+        return 4096
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(4096))]
+        if index < 0:
+            index += 4096
+        if index < 0 or index > 4095:
+            raise IndexError("node index out of range")
+        node = self.nodes.get(index)
+        if node is None:
+            node = Node(copy_node_data(self.base_data(index)))
+            node.pos = index
+            self.nodes[index] = node
+        return node
+
+    def __setitem__(self, index, node):
+        if index < 0:
+            index += 4096
+        if index < 0 or index > 4095:
+            raise IndexError("node index out of range")
+        node.pos = index
+        self.nodes[index] = node
+
+    def __iter__(self):
+        for index in range(4096):
+            yield self[index]
+
+    def is_uniform(self):
+        return self.uniform and all(node.data == self.base for node in self.nodes.values())
+
+    def node_data(self):
+        # Data of every node, without creating Nodes for the ones that were never accessed.
+        # The dicts are not copies, so they must not be modified.
+        if self.is_uniform():
+            return [self.base] * 4096
+        node_data = [self.base] * 4096 if self.uniform else list(self.base)
+        for index, node in self.nodes.items():
+            node_data[index] = node.data
+        return node_data
+
+    def set_param1(self, values):
+        # Bulk update without creating Nodes: the unaccessed nodes get a new base
+        for index, node in self.nodes.items():
+            node.data["param1"] = values[index]
+        if self.uniform and values.count(values[0]) == 4096:
+            self.base = dict(self.base, param1=values[0])
+        else:
+            self.base = tuple(dict(self.base_data(index), param1=values[index]) for index in range(4096))
+            self.uniform = False
+
+    def set_node_data(self, node_data):
+        # Replaces every node at once. Nodes that were already accessed keep their Node object.
+        for index, node in self.nodes.items():
+            node.data = copy_node_data(node_data[index])
+        if not self.nodes and node_data.count(node_data[0]) == 4096:
+            self.base = node_data[0]
+            self.uniform = True
+        else:
+            self.base = tuple(node_data)
+            self.uniform = False
+
+    def copy(self):
+        node_list = NodeList(self.base, uniform=self.uniform)
+        for index, node in self.nodes.items():
+            node_list[index] = Node(copy_node_data(node.data))
+        return node_list
+
 class StaticObject:
+    # Blocks can hold hundreds of these, so they are kept small and only decoded when the data is used
+    __slots__ = ("object_type", "pos", "raw", "parsed")
+
     def __init__(self, object_type, pos, data):
         self.object_type = object_type
         self.pos = pos
         self.raw = data
-        self.data = self.parse(data)
+        self.parsed = None
+
+    @property
+    def data(self):
+        if self.parsed is None:
+            self.parsed = self.parse()
+        return self.parsed
+
+    @data.setter
+    def data(self, data):
+        self.parsed = data
+
+    @property
+    def entity_name(self):
+        if self.parsed is not None:
+            return self.parsed["entity_name"]
+        if not self.raw:
+            return None
+        # Only the name is read, static_data (often many KB of serialized Lua) is left alone
+        name_len = unpack("u16", self.raw[1:3])
+        return self.raw[3:3 + name_len].decode("utf-8")
 
     def parse(self, data=None):
         if data is None:
@@ -187,9 +638,9 @@ class StaticObject:
 
     def serialize(self, data=None):
         if data is None:
-            data = self.data
-            if data is None:
-                return None
+            if self.parsed is None:
+                return self.raw or None # Unchanged, so the original bytes can be reused
+            data = self.parsed
 
         serialized_data = bytearray()
 
@@ -212,16 +663,16 @@ class StaticObject:
         serialized_data.extend(pack("s16", data["hp"]))
 
         # s32 velocity.x * 10000
-        serialized_data.extend(pack("s32", int(data["velocity"][0]*10000)))
+        serialized_data.extend(pack("s32", round(data["velocity"][0]*10000)))
 
         # s32 velocity.y * 10000
-        serialized_data.extend(pack("s32", int(data["velocity"][1]*10000)))
+        serialized_data.extend(pack("s32", round(data["velocity"][1]*10000)))
 
         # s32 velocity.z * 10000
-        serialized_data.extend(pack("s32", int(data["velocity"][2]*10000)))
+        serialized_data.extend(pack("s32", round(data["velocity"][2]*10000)))
 
         # s32 yaw * 1000
-        serialized_data.extend(pack("s32", int(data["yaw"]*1000)))
+        serialized_data.extend(pack("s32", round(data["yaw"]*1000)))
 
         # Since protocol version 37:
 
@@ -230,10 +681,10 @@ class StaticObject:
             serialized_data.extend(pack("u8", data["version2"]))
 
             # s32 pitch * 1000
-            serialized_data.extend(pack("s32", int(data["pitch"]*1000)))
+            serialized_data.extend(pack("s32", round(data["pitch"]*1000)))
 
             # s32 roll * 1000
-            serialized_data.extend(pack("s32", int(data["roll"]*1000)))
+            serialized_data.extend(pack("s32", round(data["roll"]*1000)))
 
             # if version2 >= 2:
             if data["version2"] >= 2:
@@ -256,7 +707,7 @@ class MapBlock:
                 "day": {"X-": False, "Y-": False, "Z-": False, "Z+": False, "Y+": False, "X+": False}},
             "timestamp": 4294967295,
             "name_id_mapping_version": 0, "name_id_mappings": [],
-            "content_width": 2, "params_width": 2, "node_data": [], "nodes": [Node() for _ in range(4096)],
+            "content_width": 2, "params_width": 2, "node_data": [], "nodes": NodeList(Node().data, uniform=True),
             "node_metadata_version": 2, "node_metadata": [],
             "static_object_version": 0, "static_objects": [],
             "length_of_single_timer": 10, "timers": []
@@ -333,27 +784,13 @@ class MapBlock:
         # Node data (+ node metadata) is Zlib-compressed before map version format 29
         # TODO: find the end of the compressed section so that we can decompress it
 
-        param0_fields = []
-        param1_fields = []
-        param2_fields = []
-        
-        for _ in range(4096): # param0: Either 1 byte x 4096 or 2 bytes x 4096
-            param0, data = pop_bytes(data, content_width)
-            param0_fields.append(param0)
+        param0_fields, data = pop_bytes(data, 4096 * content_width) # param0: Either 1 byte x 4096 or 2 bytes x 4096
 
-        for _ in range(4096): # param1: 1 byte x 4096
-            param1, data = pop_bytes(data, params_width // 2)
-            param1_fields.append(param1)
+        param1_fields, data = pop_bytes(data, 4096 * (params_width // 2)) # param1: 1 byte x 4096
 
-        for _ in range(4096): # param2: 1 byte x 4096
-            param2, data = pop_bytes(data, params_width // 2)
-            param2_fields.append(param2)
-        
-        node_data = []
-        for n in range(len(param0_fields)):
-            node = {"param0": param0_fields[n], "param1": param1_fields[n], "param2": param2_fields[n]}
-            node_data.append(node)
-        parsed_data["node_data"] = node_data
+        param2_fields, data = pop_bytes(data, 4096 * (params_width // 2)) # param2: 1 byte x 4096
+
+        parsed_data["node_data"] = {"param0": param0_fields, "param1": param1_fields, "param2": param2_fields}
 
         if version < 23:
             parsed_data["node_metadata_version"], data = pop_bytes(data, 2)
@@ -394,7 +831,7 @@ class MapBlock:
 
                 all_metadata = []
                 for _ in range(struct.unpack(">H", parsed_data["num_node_metadata"])[0]):
-                    metadata = {"position": None, "num_vars": None, "vars": None}
+                    metadata = {"position": None, "num_vars": None, "vars": None, "inventory": None}
 
                     metadata["position"], data = pop_bytes(data, 2)
 
@@ -410,11 +847,7 @@ class MapBlock:
 
                         var["val_len"], data = pop_bytes(data, 4)
 
-                        if var["key"].decode("utf-8") == "infotext" and is_inventory(data): # This is the most reliable way to check if this is an inventory
-                            var["value"], data = extract_inventory(data)
-
-                        else:
-                            var["value"], data = pop_bytes(data, unpack("u32", var["val_len"]))
+                        var["value"], data = pop_bytes(data, unpack("u32", var["val_len"]))
 
                         if struct.unpack(">B", parsed_data["node_metadata_version"])[0] == 2:
                             var["is_private"], data = pop_bytes(data, 1)
@@ -426,6 +859,9 @@ class MapBlock:
                     if len(var_s) > 0:
                         metadata["vars"] = var_s
 
+                    # Every node metadata ends with its serialized inventory (just "EndInventory" if it has none)
+                    metadata["inventory"], data = extract_inventory(data)
+
                     all_metadata.append(metadata)
 
                 if len(all_metadata) > 0:
@@ -570,8 +1006,21 @@ class MapBlock:
 
         # TODO: add safeguards to make sure content_width and params_width are valid
 
-        for node in parsed_data["node_data"]:
-            pretty_data["node_data"].append({"param0": unpack("u"+str(pretty_data["content_width"]*8), node["param0"]), "param1": unpack("u"+str(pretty_data["params_width"]*4), node["param1"]), "param2": unpack("u"+str(pretty_data["params_width"]*4), node["param2"])})
+        param0_fields = unpack_array(pretty_data["content_width"], parsed_data["node_data"]["param0"])
+        param1_fields = unpack_array(pretty_data["params_width"] // 2, parsed_data["node_data"]["param1"])
+        param2_fields = unpack_array(pretty_data["params_width"] // 2, parsed_data["node_data"]["param2"])
+
+        # A uniform block (e.g. all air or all stone) has the same param0, param1 and param2 everywhere
+        uniform = all(
+            fields.count(fields[0]) == len(fields)
+            for fields in (param0_fields, param1_fields, param2_fields)
+        )
+
+        if uniform:
+            pretty_data["node_data"] = [{"param0": param0_fields[0], "param1": param1_fields[0], "param2": param2_fields[0]}] * 4096
+        else:
+            for n in range(4096):
+                pretty_data["node_data"].append({"param0": param0_fields[n], "param1": param1_fields[n], "param2": param2_fields[n]})
 
         if version < 23:
             pretty_data["node_metadata_version"] = unpack("u16", parsed_data["node_metadata_version"])
@@ -580,7 +1029,7 @@ class MapBlock:
             pretty_data["node_metadata_version"] = unpack("u8", parsed_data["node_metadata_version"])
             
             for metadata in (parsed_data["node_metadata"] or []):
-                pretty_metadata = {"position": unpack("u16", metadata["position"]), "vars": []}
+                pretty_metadata = {"position": unpack("u16", metadata["position"]), "vars": [], "inventory": Inventory(metadata["inventory"])}
 
                 for var in (metadata["vars"] or []):
                     is_private = False
@@ -611,28 +1060,30 @@ class MapBlock:
         for timer in (parsed_data["timers"] or []):
             pretty_data["timers"].append({"position": unpack("u16", timer["position"]), "timeout": unpack("s32", timer["timeout"])/1000, "elapsed": unpack("s32", timer["elapsed"])/1000})
 
+        names = {}
+        for mapping in pretty_data["name_id_mappings"]:
+            names[mapping["id"]] = mapping["name"]
+
+        if uniform and not pretty_data["node_metadata"] and not pretty_data["timers"]:
+            # Stored in O(1) memory: one node dict shared by the whole block
+            node = pretty_data["node_data"][0]
+            pretty_data["nodes"] = NodeList({"name": names.get(node["param0"], ""), "param1": node["param1"], "param2": node["param2"], "metadata": [], "inventory": None, "timers": []}, uniform=True)
+            return pretty_data
+
         new_nodes = []
         for node in pretty_data["node_data"]:
-            name = ""
-            for mapping in pretty_data["name_id_mappings"]:
-                if mapping["id"] == node["param0"]:
-                    name = mapping["name"]
-                    break
-            new_nodes.append({"name": name, "param1": node["param1"], "param2": node["param2"], "metadata": [], "timers": []})
+            new_nodes.append({"name": names.get(node["param0"], ""), "param1": node["param1"], "param2": node["param2"], "metadata": [], "inventory": None, "timers": []})
         for metadata in pretty_data["node_metadata"]:
             new_nodes[metadata["position"]]["metadata"] = metadata["vars"]
+            new_nodes[metadata["position"]]["inventory"] = metadata["inventory"]
         for timer in pretty_data["timers"]:
             new_nodes[timer["position"]]["timers"].append({"timeout": timer["timeout"], "elapsed": timer["elapsed"]})
-        
-        node_classes = []
-        for node in new_nodes:
-            node_classes.append(Node(node))
 
-        pretty_data["nodes"] = node_classes
+        pretty_data["nodes"] = NodeList(tuple(new_nodes))
 
         return pretty_data
 
-    def serialize(self, data=None, compressed=True):
+    def serialize(self, data=None, compressed=True, level=3, verbose=True):
         if data == None:
             data = self.data
 
@@ -640,15 +1091,19 @@ class MapBlock:
 
         # TODO: support serializing in other MapBlock format versions?
 
-        if data["version"] != 29:
+        if data["version"] != 29 and verbose:
             print("WARNING: data will be converted to MapBlock format version 29")
 
         # Quickly ensure that all of the node pos's are correct
-        
-        node_pos = 0
-        for node in data["nodes"]:
-            node.pos = node_pos
-            node_pos += 1
+
+        if isinstance(data["nodes"], NodeList):
+            node_data = data["nodes"].node_data()
+        else:
+            node_pos = 0
+            for node in data["nodes"]:
+                node.pos = node_pos
+                node_pos += 1
+            node_data = [node.data for node in data["nodes"]]
 
         # u8 version
         serialized_data.extend(pack("u8", 29))
@@ -725,16 +1180,16 @@ class MapBlock:
         # u8 name_id_mapping_version
         serialized_data.extend(pack("u8", 0)) # Should be 0
 
-        names = []
-        for node in data["nodes"]:
-            if not node.data["name"] in names:
-                names.append(node.data["name"])
+        # A uniform block (every node shares one dict) only needs that one node looked at
+        uniform = node_data.count(node_data[0]) == 4096
 
-        name_id_mappings = {}
-        current_id = 0
-        for name in names:
-            name_id_mappings[name] = current_id
-            current_id += 1
+        # IDs are handed out in order of first appearance
+        if uniform:
+            name_id_mappings = {node_data[0]["name"]: 0}
+            param0_fields = [0] * 4096
+        else:
+            name_id_mappings = {}
+            param0_fields = [name_id_mappings.setdefault(node["name"], len(name_id_mappings)) for node in node_data]
 
         # u16 num_name_id_mappings
         if name_id_mappings:
@@ -761,23 +1216,20 @@ class MapBlock:
         serialized_data.extend(pack("u8", (data["params_width"] or 2))) # Should be 2
 
         # u<content_width*8>[4096] param0 fields
-        for node in data["nodes"]:
-            serialized_data.extend(pack("u"+str((data["content_width"] or 2)*8), name_id_mappings[node.data["name"]]))
+        serialized_data.extend(pack_array((data["content_width"] or 2), param0_fields))
 
         # u8[4096] param1 fields
-        for node in data["nodes"]:
-            serialized_data.extend(pack("u"+str((data["params_width"] or 2)*4), node.data["param1"]))
+        serialized_data.extend(pack_array((data["params_width"] or 2) // 2, [node["param1"] for node in node_data]))
 
         # u8[4096] param2 fields
-        for node in data["nodes"]:
-            serialized_data.extend(pack("u"+str((data["params_width"] or 2)*4), node.data["param2"]))
+        serialized_data.extend(pack_array((data["params_width"] or 2) // 2, [node["param2"] for node in node_data]))
 
         # u8 node_metadata_version
         # If there is 0 node metadata, this is 0, otherwise it is 2
-        node_metadata = []
-        for node in data["nodes"]:
-            if node.data["metadata"]:
-                node_metadata.append(node)
+        if uniform and not has_node_metadata(node_data[0]):
+            node_metadata = []
+        else:
+            node_metadata = [(node_pos, node) for node_pos, node in enumerate(node_data) if has_node_metadata(node)]
 
         if len(node_metadata) > 0:
             serialized_data.extend(pack("u8", 2))
@@ -786,38 +1238,42 @@ class MapBlock:
             serialized_data.extend(pack("u16", len(node_metadata)))
 
             # foreach num_node_metadata
-            for node in node_metadata:
+            for node_pos, node in node_metadata:
                 # u16 position
-                serialized_data.extend(pack("u16", node.pos))
+                serialized_data.extend(pack("u16", node_pos))
 
                 # u32 num_vars
-                if node.data["metadata"]:
-                    if len(node.data["metadata"]) > 0:
-                        serialized_data.extend(pack("u32", len(node.data["metadata"])))
-                        
-                        # foreach num_vars
-                        for var in node.data["metadata"]:
-                            # u16 key_len
-                            serialized_data.extend(pack("u16", len(var["key"])))
-
-                            # u8[key_len] key
-                            serialized_data.extend(var["key"].encode("utf-8"))
-
-                            # u32 val_len
-                            serialized_data.extend(pack("u32", len(var["value"])))
-
-                            # u8[val_len] value
-                            serialized_data.extend(var["value"].encode("utf-8"))
-
-                            # u8 is_private
-                            if var["is_private"]:
-                                serialized_data.extend(pack("u8", 1))
-                            else:
-                                serialized_data.extend(pack("u8", 0))
+                serialized_data.extend(pack("u32", len(node["metadata"] or [])))
+
+                # foreach num_vars
+                for var in (node["metadata"] or []):
+                    key = var["key"].encode("utf-8")
+                    value = var["value"].encode("utf-8")
+
+                    # u16 key_len
+                    serialized_data.extend(pack("u16", len(key)))
+
+                    # u8[key_len] key
+                    serialized_data.extend(key)
+
+                    # u32 val_len
+                    serialized_data.extend(pack("u32", len(value)))
+
+                    # u8[val_len] value
+                    serialized_data.extend(value)
+
+                    # u8 is_private
+                    if var["is_private"]:
+                        serialized_data.extend(pack("u8", 1))
                     else:
-                        serialized_data.extend(pack("u32", 0))
+                        serialized_data.extend(pack("u8", 0))
+
+                # Serialized inventory
+                inventory = node.get("inventory")
+                if inventory is not None:
+                    serialized_data.extend(inventory.serialize())
                 else:
-                    serialized_data.extend(pack("u32", 0))
+                    serialized_data.extend(b"EndInventory\n")
         else:
             serialized_data.extend(pack("u8", 0))
 
@@ -835,13 +1291,13 @@ class MapBlock:
                     serialized_data.extend(pack("u8", obj.object_type))
 
                     # s32 pos_x_nodes * 10000
-                    serialized_data.extend(pack("s32", int(obj.pos[0]*10000)))
+                    serialized_data.extend(pack("s32", round(obj.pos[0]*10000)))
 
                     # s32 pos_y_nodes * 10000
-                    serialized_data.extend(pack("s32", int(obj.pos[1]*10000)))
+                    serialized_data.extend(pack("s32", round(obj.pos[1]*10000)))
 
                     # s32 pos_z_nodes * 10000
-                    serialized_data.extend(pack("s32", int(obj.pos[2]*10000)))
+                    serialized_data.extend(pack("s32", round(obj.pos[2]*10000)))
 
                     serialized = obj.serialize()
 
@@ -863,10 +1319,10 @@ class MapBlock:
         serialized_data.extend(pack("u8", (data["length_of_single_timer"] or 10)))
 
         timers = []
-        for node in data["nodes"]:
-            if len(node.data["timers"]) > 0:
-                for timer in node.data["timers"]:
-                    timers.append({"position": node.pos, "timeout": timer["timeout"], "elapsed": timer["elapsed"]})
+        for node_pos, node in enumerate(node_data if not uniform or node_data[0]["timers"] else []):
+            if node["timers"]:
+                for timer in node["timers"]:
+                    timers.append({"position": node_pos, "timeout": timer["timeout"], "elapsed": timer["elapsed"]})
 
         # u16 num_of_timers
         if len(timers) > 0:
@@ -878,10 +1334,10 @@ class MapBlock:
                 serialized_data.extend(pack("u16", timer["position"]))
 
                 # s32 timeout
-                serialized_data.extend(pack("s32", int(timer["timeout"]*1000)))
+                serialized_data.extend(pack("s32", round(timer["timeout"]*1000)))
 
                 # s32 elapsed
-                serialized_data.extend(pack("s32", int(timer["elapsed"]*1000)))
+                serialized_data.extend(pack("s32", round(timer["elapsed"]*1000)))
 
         else:
             serialized_data.extend(pack("u16", 0))
@@ -889,7 +1345,7 @@ class MapBlock:
         serialized_data = bytes(serialized_data)
 
         if compressed:
-            serialized_data = serialized_data[:1] + zstd_compress(serialized_data[1:])
+            serialized_data = serialized_data[:1] + zstd_compress(serialized_data[1:], level=level)
 
         return serialized_data
 
@@ -909,15 +1365,583 @@ class MapBlock:
 
         return self
 
-class World:
-    def __init__(self, conn):
+    def get_node_data(self, copy=True):
+        # Data dicts of all 4096 nodes; change nodes with set_node_data. With copy=False the dicts are shared
+        # with the node base (and so with cached and copied MapBlocks) and must only be read.
+        nodes = self.data["nodes"]
+        if isinstance(nodes, NodeList):
+            node_data = nodes.node_data()
+        else:
+            node_data = [node.data for node in nodes]
+        if copy:
+            return [copy_node_data(data) for data in node_data]
+        return node_data
+
+    def set_param1(self, values):
+        nodes = self.data["nodes"]
+        if isinstance(nodes, NodeList):
+            nodes.set_param1(values)
+        else:
+            for index, node in enumerate(nodes):
+                node.data["param1"] = values[index]
+        return self
+
+    def set_node_data(self, node_data):
+        nodes = self.data["nodes"]
+        if isinstance(nodes, NodeList):
+            nodes.set_node_data(node_data)
+        else:
+            for index, node in enumerate(nodes):
+                node.data = copy_node_data(node_data[index])
+        return self
+
+    def copy(self):
+        # Node data is shared with this MapBlock until a node is accessed, everything else is copied
+        mapblock = MapBlock(pos=self.pos)
+        mapblock.raw = self.raw
+        mapblock.data = {}
+        for key, value in self.data.items():
+            if key == "nodes":
+                if isinstance(value, NodeList):
+                    mapblock.data[key] = value.copy()
+                else:
+                    mapblock.data[key] = [Node(copy_node_data(node.data)) for node in value]
+            elif key == "node_data":
+                mapblock.data[key] = value
+            else:
+                mapblock.data[key] = copy.deepcopy(value)
+        return mapblock
+
+class MapBlockCache:
+    # Identical blobs (untouched air or stone blocks are very common) are only parsed once.
+    # Every lookup returns its own copy-on-write MapBlock, so they can be edited safely.
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, pos, data, verbose=True):
+        key = hashlib.blake2b(data, digest_size=16).digest()
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+
+        if cached is None:
+            cached = MapBlock(pos=pos, data=data, verbose=verbose)
+            with self.lock:
+                self.misses += 1
+                self.entries[key] = cached
+                if len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+
+        mapblock = cached.copy()
+        mapblock.pos = pos
+        return mapblock
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+def is_busy_error(error):
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+class ConnectionPool:
+    def __init__(self, filename, readonly=False, wal=False, mmap_size=None, cache_size=None, timeout=5.0):
+        self.filename = filename
+        self.readonly = readonly
+        self.wal = wal
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def connect(self):
+        if self.readonly:
+            # mode=ro never takes a write lock, so a running server can keep writing to the world
+            uri = pathlib.Path(self.filename).resolve().as_uri() + "?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, timeout=self.timeout, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.filename, timeout=self.timeout, check_same_thread=False)
+
+        # Setting the journal mode is a write, so it is only done on read-write connections
+        if self.wal and not self.readonly:
+            conn.execute("PRAGMA journal_mode=WAL")
+        self.configure(conn, mmap_size=self.mmap_size, cache_size=self.cache_size)
+        if self.readonly:
+            conn.execute("PRAGMA query_only=1")
+
+        return conn
+
+    def configure(self, conn, mmap_size=None, cache_size=None):
+        if mmap_size is not None:
+            conn.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+        if cache_size is not None:
+            conn.execute(f"PRAGMA cache_size={int(cache_size)}")
+
+    def get(self):
+        # sqlite3 connections must not be shared between threads, so each thread gets its own
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.connect()
+            self.local.conn = conn
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def close(self):
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+        self.local = threading.local()
+
+class Backend(abc.ABC):
+    readonly = False
+
+    @abc.abstractmethod
+    def get_raw(self, pos):
+        pass
+
+    @abc.abstractmethod
+    def put_raw(self, pos, data):
+        pass
+
+    @abc.abstractmethod
+    def delete_raw(self, pos):
+        pass
+
+    @abc.abstractmethod
+    def iter_keys(self, min_pos=None, max_pos=None):
+        pass
+
+    @abc.abstractmethod
+    def iter_range(self, min_pos, max_pos):
+        pass
+
+    def put_many(self, items):
+        for pos, data in items:
+            self.put_raw(pos, data)
+
+    def delete_many(self, positions):
+        for pos in positions:
+            self.delete_raw(pos)
+
+    def iter_raw_batches(self, batch_size=256, prefetch=8, mmap_size=None):
+        batch = []
+        for pos in self.iter_keys():
+            batch.append((pos, self.get_raw(pos)))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def compact(self, incremental=False, progress=None):
+        pass
+
+    def get_size(self):
+        return None
+
+    def close(self):
+        pass
+
+    def check_writable(self):
+        if self.readonly:
+            raise ValueError("World was opened read-only")
+
+class SQLiteBackend(Backend):
+    def __init__(self, conn=None, pool=None, readonly=False, retries=5, backoff=0.05):
         self.conn = conn
-        self.filename = "<unknown>"
+        self.pool = pool
+        self.readonly = readonly
+        self.retries = retries
+        self.backoff = backoff
+
+    @classmethod
+    def from_file(cls, filename, readonly=False, create=False, wal=False, mmap_size=None, cache_size=None, timeout=5.0, retries=5, backoff=0.05):
+        if readonly and not os.path.exists(filename):
+            raise FileNotFoundError(filename)
+        pool = ConnectionPool(filename, readonly=readonly, wal=wal, mmap_size=mmap_size, cache_size=cache_size, timeout=timeout)
+        instance = cls(pool.get(), pool=pool, readonly=readonly, retries=retries, backoff=backoff)
+        if create and not readonly:
+            instance.execute("CREATE TABLE IF NOT EXISTS blocks (x INTEGER, y INTEGER, z INTEGER, data BLOB NOT NULL, PRIMARY KEY (x, z, y))", commit=True)
+        return instance
 
     def close(self):
-        if self.conn:
+        if self.pool:
+            self.pool.close()
+            self.pool = None
+        elif self.conn:
             self.conn.close()
-            self.conn = None
+        self.conn = None
+
+    def get_connection(self):
+        if self.pool:
+            return self.pool.get()
+        return self.conn
+
+    def run(self, func):
+        # Retry with exponential backoff if the server is holding a lock on the database
+        delay = self.backoff
+        attempt = 0
+        while True:
+            conn = self.get_connection()
+            try:
+                return func(conn)
+            except sqlite3.OperationalError as e:
+                if attempt >= self.retries or not is_busy_error(e):
+                    raise
+                if conn.in_transaction:
+                    conn.rollback()
+                time.sleep(delay)
+                delay *= 2
+                attempt += 1
+
+    def execute(self, sql, params=(), commit=False):
+        def run(conn):
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+            if commit:
+                conn.commit()
+            return rows
+
+        return self.run(run)
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+
+        def run(conn):
+            # Every row goes into one transaction, which is far faster than committing each one
+            conn.executemany(sql, seq_of_params)
+            conn.commit()
+
+        self.run(run)
+
+    def get_raw(self, pos):
+        rows = self.execute(
+            "SELECT data FROM blocks WHERE x=? AND y=? AND z=?",
+            (pos[0], pos[1], pos[2])
+        )
+        if rows:
+            return rows[0][0]
+        return None
+
+    def put_raw(self, pos, data):
+        self.put_many([(pos, data)])
+
+    def put_many(self, items):
+        self.check_writable()
+        self.executemany(
+            "INSERT OR REPLACE INTO blocks (x, y, z, data) VALUES (?, ?, ?, ?)",
+            ((pos[0], pos[1], pos[2], sqlite3.Binary(data)) for pos, data in items)
+        )
+
+    def delete_raw(self, pos):
+        self.delete_many([pos])
+
+    def delete_many(self, positions):
+        self.check_writable()
+        self.executemany(
+            "DELETE FROM blocks WHERE x=? AND y=? AND z=?",
+            ((pos[0], pos[1], pos[2]) for pos in positions)
+        )
+
+    def iter_query(self, sql, params=(), batch_size=256):
+        # Streams the rows of a query instead of fetching them all at once. Only starting the query is retried:
+        # once it has returned its first row it holds a read lock until the cursor is done, so a writer
+        # cannot make the rest of it fail as busy.
+        cursor = self.run(lambda conn: conn.execute(sql, params))
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+
+    def iter_keys(self, min_pos=None, max_pos=None):
+        if min_pos is None:
+            rows = self.iter_query("SELECT x, y, z FROM blocks", batch_size=4096)
+        else:
+            rows = self.iter_query(
+                "SELECT x, y, z FROM blocks WHERE x BETWEEN ? AND ? AND y BETWEEN ? AND ? AND z BETWEEN ? AND ?",
+                (min_pos[0], max_pos[0], min_pos[1], max_pos[1], min_pos[2], max_pos[2]),
+                batch_size=4096
+            )
+        for row in rows:
+            yield (row[0], row[1], row[2])
+
+    def iter_range(self, min_pos, max_pos):
+        rows = self.iter_query(
+            "SELECT x, y, z, data FROM blocks WHERE x BETWEEN ? AND ? AND y BETWEEN ? AND ? AND z BETWEEN ? AND ?",
+            (min_pos[0], max_pos[0], min_pos[1], max_pos[1], min_pos[2], max_pos[2])
+        )
+        for row in rows:
+            yield (row[0], row[1], row[2]), row[3]
+
+    def fetch_raw_batches(self, conn, batch_size, mmap_size=None):
+        if self.pool:
+            self.pool.configure(conn, mmap_size=mmap_size)
+        cursor = conn.cursor()
+        # rowid order follows the table's on-disk layout, so the blobs are read sequentially
+        cursor.execute("SELECT x, y, z, data FROM blocks ORDER BY rowid")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [((row[0], row[1], row[2]), row[3]) for row in rows]
+
+    def iter_raw_batches(self, batch_size=256, prefetch=8, mmap_size=268435456):
+        if not self.pool:
+            # Without a pool the only connection belongs to this thread, so there is no prefetching
+            yield from self.fetch_raw_batches(self.conn, batch_size)
+            return
+
+        batches = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def producer():
+            conn = self.pool.connect()
+            try:
+                for batch in self.fetch_raw_batches(conn, batch_size, mmap_size=mmap_size):
+                    if not put(batch):
+                        return
+                put(done)
+            except Exception as e:
+                put(e)
+            finally:
+                conn.close()
+
+        thread = threading.Thread(target=producer, daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is done:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
+
+    def get_size(self):
+        page_count = self.execute("PRAGMA page_count")[0][0]
+        page_size = self.execute("PRAGMA page_size")[0][0]
+        return page_count * page_size
+
+    def compact(self, incremental=False, progress=None, pages_per_step=1024):
+        self.check_writable()
+        conn = self.get_connection()
+
+        # Incremental vacuum only works on databases created with auto_vacuum=INCREMENTAL,
+        # otherwise a full VACUUM is needed
+        if incremental and self.execute("PRAGMA auto_vacuum")[0][0] == 2:
+            while True:
+                free_pages = self.execute("PRAGMA freelist_count")[0][0]
+                if progress:
+                    progress({"phase": "vacuum", "free_pages": free_pages})
+                if free_pages == 0:
+                    break
+                self.execute(f"PRAGMA incremental_vacuum({int(pages_per_step)})", commit=True)
+            return
+
+        if progress:
+            conn.set_progress_handler(lambda: progress({"phase": "vacuum"}), 100000)
+        try:
+            self.execute("VACUUM")
+        finally:
+            if progress:
+                conn.set_progress_handler(None, 0)
+
+packed_magic = b"MTPK"
+packed_version = 1
+packed_record_format = ">BhhhI" # u8 op, s16 x, s16 y, s16 z, u32 data length
+packed_record_size = struct.calcsize(packed_record_format)
+
+class PackedFileBackend(Backend):
+    # A single append-only file of (op, pos, length, data) records. Overwritten and deleted blocks
+    # stay in the file until compact() is called; the in-memory index always points at the newest record.
+
+    def __init__(self, filename, readonly=False):
+        self.filename = filename
+        self.readonly = readonly
+        self.index = {}
+        self.lock = threading.Lock()
+        self.map = None
+
+        if not os.path.exists(filename):
+            if readonly:
+                raise FileNotFoundError(filename)
+            with open(filename, "wb") as f:
+                f.write(packed_magic + pack("u8", packed_version))
+
+        self.file = open(filename, "rb" if readonly else "r+b")
+        self.load_index()
+
+    @classmethod
+    def from_file(cls, filename, readonly=False):
+        return cls(filename, readonly=readonly)
+
+    def load_index(self):
+        self.file.seek(0)
+        header = self.file.read(len(packed_magic) + 1)
+        if header[:len(packed_magic)] != packed_magic:
+            raise ValueError(f"{self.filename} is not a packed mtanvil world")
+        if header[len(packed_magic)] != packed_version:
+            raise ValueError(f"Unsupported packed world version {header[len(packed_magic)]}")
+
+        # Only the record headers are read here, the block data is skipped over
+        offset = self.file.tell()
+        end = os.fstat(self.file.fileno()).st_size
+        while offset + packed_record_size <= end:
+            self.file.seek(offset)
+            op, x, y, z, length = struct.unpack(packed_record_format, self.file.read(packed_record_size))
+            if offset + packed_record_size + length > end:
+                break # Truncated final record from an interrupted write
+            if op == 1:
+                self.index[(x, y, z)] = (offset + packed_record_size, length)
+            else:
+                self.index.pop((x, y, z), None)
+            offset += packed_record_size + length
+        self.end = offset
+
+        # Drop what is left of a truncated record, otherwise its header would claim the records appended after it
+        if offset < end and not self.readonly:
+            self.file.truncate(offset)
+
+    def remap(self):
+        if self.map:
+            self.map.close()
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read_at(self, offset, length):
+        with self.lock:
+            if self.map is None or offset + length > len(self.map):
+                self.file.flush()
+                self.remap()
+            return self.map[offset:offset + length]
+
+    def append(self, records):
+        self.check_writable()
+        with self.lock:
+            self.file.seek(self.end)
+            for op, pos, data in records:
+                self.file.write(struct.pack(packed_record_format, op, pos[0], pos[1], pos[2], len(data)))
+                if op == 1:
+                    self.index[pos] = (self.end + packed_record_size, len(data))
+                    self.file.write(data)
+                else:
+                    self.index.pop(pos, None)
+                self.end += packed_record_size + len(data)
+            self.file.flush()
+
+    def get_raw(self, pos):
+        entry = self.index.get(tuple(pos))
+        if entry is None:
+            return None
+        return self.read_at(entry[0], entry[1])
+
+    def put_raw(self, pos, data):
+        self.put_many([(pos, data)])
+
+    def put_many(self, items):
+        self.append([(1, tuple(pos), bytes(data)) for pos, data in items])
+
+    def delete_raw(self, pos):
+        self.delete_many([pos])
+
+    def delete_many(self, positions):
+        self.append([(0, tuple(pos), b"") for pos in positions if tuple(pos) in self.index])
+
+    def iter_keys(self, min_pos=None, max_pos=None):
+        if min_pos is None:
+            return iter(list(self.index.keys()))
+        return iter([pos for pos in list(self.index.keys()) if pos_in_region(pos, (min_pos, max_pos))])
+
+    def iter_range(self, min_pos, max_pos):
+        for pos in list(self.index.keys()):
+            if all(min_pos[i] <= pos[i] <= max_pos[i] for i in range(3)):
+                yield pos, self.get_raw(pos)
+
+    def iter_raw_batches(self, batch_size=256, prefetch=8, mmap_size=None):
+        # Reading in file order keeps the access pattern sequential
+        entries = sorted(self.index.items(), key=lambda item: item[1][0])
+        for i in range(0, len(entries), batch_size):
+            yield [(pos, self.read_at(offset, length)) for pos, (offset, length) in entries[i:i + batch_size]]
+
+    def get_size(self):
+        return self.end
+
+    def compact(self, incremental=False, progress=None):
+        self.check_writable()
+        temp_filename = self.filename + ".compact"
+        with open(temp_filename, "wb") as f:
+            f.write(packed_magic + pack("u8", packed_version))
+            for batch in self.iter_raw_batches():
+                for pos, data in batch:
+                    f.write(struct.pack(packed_record_format, 1, pos[0], pos[1], pos[2], len(data)))
+                    f.write(data)
+                if progress:
+                    progress({"phase": "vacuum", "blocks": len(batch)})
+        with self.lock:
+            if self.map:
+                self.map.close()
+                self.map = None
+            self.file.close()
+            os.replace(temp_filename, self.filename)
+            self.file = open(self.filename, "r+b")
+            self.index = {}
+            self.load_index()
+
+    def close(self):
+        with self.lock:
+            if self.map:
+                self.map.close()
+                self.map = None
+            if self.file:
+                self.file.close()
+                self.file = None
+
+class World:
+    def __init__(self, backend, cache=None):
+        if not isinstance(backend, Backend):
+            backend = SQLiteBackend(backend) # A plain sqlite3 connection
+        self.backend = backend
+        self.cache = cache
+        self.filename = "<unknown>"
+
+    @property
+    def conn(self):
+        return getattr(self.backend, "conn", None)
+
+    @property
+    def readonly(self):
+        return self.backend.readonly
+
+    def close(self):
+        if self.backend:
+            self.backend.close()
 
     def __enter__(self):
         return self
@@ -927,43 +1951,537 @@ class World:
         return False
 
     @classmethod
-    def from_file(cls, filename):
-        conn = sqlite3.connect(filename)
-        instance = cls(conn)
+    def from_file(cls, filename, readonly=False, create=False, wal=False, mmap_size=None, cache_size=None, timeout=5.0, retries=5, backoff=0.05, cache=None):
+        backend = SQLiteBackend.from_file(filename, readonly=readonly, create=create, wal=wal, mmap_size=mmap_size, cache_size=cache_size, timeout=timeout, retries=retries, backoff=backoff)
+        instance = cls(backend, cache=cache)
         instance.filename = filename
         return instance
 
-    def list_mapblocks(self):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT x, y, z FROM blocks")
-        rows = cursor.fetchall()
+    @classmethod
+    def from_packed_file(cls, filename, readonly=False, cache=None):
+        instance = cls(PackedFileBackend.from_file(filename, readonly=readonly), cache=cache)
+        instance.filename = filename
+        return instance
 
-        mapblocks = []
-        for row in rows:
-            mapblocks.append((row[0], row[1], row[2]))
+    def list_mapblocks(self):
+        return list(self.backend.iter_keys())
 
-        return mapblocks
+    def parse_mapblock(self, pos, data, verbose=True):
+        if self.cache:
+            return self.cache.get(pos, data, verbose=verbose)
+        return MapBlock(pos=pos, data=data, verbose=verbose)
 
     def get_mapblock(self, pos, verbose=True):
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "SELECT data FROM blocks WHERE x=? AND y=? AND z=?",
-            (pos[0], pos[1], pos[2])
-        )
-        row = cursor.fetchone()
-        if row:
-            return MapBlock(pos=pos, data=row[0], verbose=verbose)
+        data = self.backend.get_raw(pos)
+        if data is not None:
+            return self.parse_mapblock(pos, data, verbose=verbose)
         return None
 
     def set_mapblock(self, pos, mapblock):
         if isinstance(mapblock, MapBlock):
             mapblock = mapblock.serialize()
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "UPDATE blocks SET data=? WHERE x=? AND y=? AND z=?",
-            (sqlite3.Binary(mapblock), pos[0], pos[1], pos[2])
+        self.backend.put_raw(pos, mapblock)
+
+    def set_mapblocks(self, mapblocks):
+        items = []
+        for pos, mapblock in mapblocks:
+            if isinstance(mapblock, MapBlock):
+                mapblock = mapblock.serialize()
+            items.append((pos, mapblock))
+        self.backend.put_many(items)
+
+    def delete_mapblock(self, pos):
+        self.backend.delete_raw(pos)
+
+    def iter_raw_batches(self, batch_size=256, prefetch=8, mmap_size=268435456):
+        return self.backend.iter_raw_batches(batch_size=batch_size, prefetch=prefetch, mmap_size=mmap_size)
+
+    def iter_raw_mapblocks(self, batch_size=256, prefetch=8, mmap_size=268435456):
+        for batch in self.iter_raw_batches(batch_size=batch_size, prefetch=prefetch, mmap_size=mmap_size):
+            yield from batch
+
+    def scan(self, batch_size=256, prefetch=8, mmap_size=268435456, verbose=False):
+        # Blocks are read by the producer thread of iter_raw_batches, so reading the next batches overlaps
+        # with parsing this one. Parsing itself is pure Python and stays on this thread: handing parsed
+        # MapBlocks back from worker processes costs more than parsing them here.
+        for batch in self.iter_raw_batches(batch_size=batch_size, prefetch=prefetch, mmap_size=mmap_size):
+            for pos, data in batch:
+                yield pos, self.parse_mapblock(pos, data, verbose=verbose)
+
+    def iter_region(self, region=None, batch_size=256):
+        if region is None:
+            yield from self.iter_raw_mapblocks(batch_size=batch_size)
+            return
+        min_block = pos_get_mapblock(region[0])
+        max_block = pos_get_mapblock(region[1])
+        yield from self.backend.iter_range(min_block, max_block)
+
+    def find_nodes(self, region=None, names=None, predicate=None, has_metadata=False, has_timers=False, batch_size=256):
+        # region is a pair of inclusive node positions, or None for the whole world.
+        # Yields the world position of every matching node.
+        if region is not None:
+            region = normalize_region(region)
+        if isinstance(names, str):
+            names = [names]
+        if names is not None:
+            names = set(names)
+
+        for block_pos, data in self.iter_region(region, batch_size=batch_size):
+            try:
+                peek = peek_mapblock(data)
+            except (struct.error, IndexError, UnicodeDecodeError):
+                peek = None
+
+            candidates = None
+            filtered = False
+            if peek:
+                if names is not None:
+                    # Prune by palette: blocks that do not contain any of the names are skipped straight away
+                    ids = {mapping_id for mapping_id, name in peek["name_id_mappings"].items() if name in names}
+                    if not ids:
+                        continue
+                    candidates = [index for index, param0 in enumerate(peek["param0"]) if param0 in ids]
+                    if not candidates:
+                        continue
+                if has_metadata and peek["node_metadata_version"] == 0:
+                    continue
+
+                if has_metadata or has_timers:
+                    # Metadata and timers are stored sparsely, so their positions are read without parsing the block
+                    try:
+                        metadata_positions, timer_positions = read_sparse_positions(peek)
+                    except (struct.error, IndexError, ValueError):
+                        metadata_positions = timer_positions = None
+                    if metadata_positions is not None:
+                        filtered = True
+                        if has_metadata:
+                            candidates = self.filter_candidates(candidates, metadata_positions)
+                        if has_timers:
+                            candidates = self.filter_candidates(candidates, timer_positions)
+                        if not candidates:
+                            continue
+                        if not predicate:
+                            yield from self.block_positions(block_pos, candidates, region)
+                            continue
+
+                if not (has_metadata or has_timers or predicate):
+                    yield from self.block_positions(block_pos, range(4096) if candidates is None else candidates, region)
+                    continue
+
+            try:
+                mapblock = self.parse_mapblock(block_pos, data, verbose=False)
+            except Exception:
+                continue
+            nodes = mapblock.data["nodes"]
+
+            if not filtered:
+                if has_metadata:
+                    positions = {metadata["position"] for metadata in mapblock.data["node_metadata"] if metadata["vars"] or not metadata["inventory"].is_empty()}
+                    candidates = self.filter_candidates(candidates, positions)
+                if has_timers:
+                    positions = {timer["position"] for timer in mapblock.data["timers"]}
+                    candidates = self.filter_candidates(candidates, positions)
+            if candidates is None:
+                candidates = range(4096)
+
+            for index in candidates:
+                node = nodes[index]
+                if names is not None and node.data["name"] not in names:
+                    continue
+                pos = self.node_world_pos(block_pos, index)
+                if region is not None and not pos_in_region(pos, region):
+                    continue
+                if predicate and not predicate(pos, node):
+                    continue
+                yield pos
+
+    def filter_candidates(self, candidates, positions):
+        if candidates is None:
+            return sorted(positions)
+        return [index for index in candidates if index in positions]
+
+    def block_positions(self, block_pos, indices, region=None):
+        for index in indices:
+            pos = self.node_world_pos(block_pos, index)
+            if region is None or pos_in_region(pos, region):
+                yield pos
+
+    def node_world_pos(self, block_pos, index):
+        local = index_to_pos(index)
+        return (
+            block_pos[0] * 16 + local[0],
+            block_pos[1] * 16 + local[1],
+            block_pos[2] * 16 + local[2],
         )
-        self.conn.commit()
+
+    def count_entities(self, region=None, batch_size=256):
+        if region is not None:
+            region = normalize_region(region)
+        counts = collections.Counter()
+        for block_pos, data in self.iter_region(region, batch_size=batch_size):
+            try:
+                static_objects = read_static_objects(data)
+            except Exception:
+                continue
+            for static_object in static_objects:
+                if region is not None and not pos_in_region(static_object.pos, region):
+                    continue
+                counts[static_object.entity_name] += 1
+        return dict(counts)
+
+    def iter_changed(self, since=None, manifest=None, checkpoint=None, batch_size=256):
+        # Yields (status, pos, data) for every block that is "new", "modified" or "deleted" (data is None).
+        # since is a game time: blocks saved after it count as modified. checkpoint is the path of a local
+        # file that keeps the highest block timestamp seen, which is used as since on the next run (blocks
+        # saved in that same second are reported again rather than missed). manifest is the path of a local
+        # file with a hash of every block, which takes precedence over since once it exists. Both files are
+        # only updated after the iteration has finished, so an interrupted run reports the same changes again.
+        # Blocks with an unknown timestamp (0xffffffff) are never reported as modified by time alone.
+        if since is None and manifest is None and checkpoint is None:
+            raise ValueError("Either since, checkpoint or manifest must be given")
+
+        inclusive = False
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                since = json.load(f)["since"]
+            inclusive = True
+        elif checkpoint and since is None:
+            since = -1 # First run with a checkpoint: every block with a timestamp is modified
+        latest = since
+
+        old_hashes = None
+        if manifest and os.path.exists(manifest):
+            with open(manifest) as f:
+                old_hashes = json.load(f)["blocks"]
+        new_hashes = {}
+
+        for pos, data in self.iter_raw_mapblocks(batch_size=batch_size):
+            key = f"{pos[0]},{pos[1]},{pos[2]}"
+
+            timestamp = None
+            if since is not None:
+                try:
+                    timestamp = read_timestamp(data)
+                except Exception:
+                    pass
+                if timestamp == 0xffffffff:
+                    timestamp = None
+                if timestamp is not None and timestamp > latest:
+                    latest = timestamp
+
+            if manifest:
+                block_hash = hashlib.blake2b(data, digest_size=16).hexdigest()
+                new_hashes[key] = block_hash
+                if old_hashes is not None:
+                    old_hash = old_hashes.pop(key, None)
+                    if old_hash is None:
+                        yield "new", pos, data
+                    elif old_hash != block_hash:
+                        yield "modified", pos, data
+                    continue
+
+            if since is None:
+                yield "new", pos, data # First run with a manifest: everything is new
+                continue
+
+            if timestamp is not None and (timestamp > since or (inclusive and timestamp == since)):
+                yield "modified", pos, data
+
+        if manifest:
+            for key in (old_hashes or {}):
+                yield "deleted", tuple(int(value) for value in key.split(",")), None
+
+            save_checkpoint(manifest, {"blocks": new_hashes})
+        if checkpoint:
+            save_checkpoint(checkpoint, {"since": latest})
+
+    def surface(self, region, ignore=("air", "ignore")):
+        # Highest node per (x, z) column of the region that is not in ignore. heights and ids are flat
+        # arrays in row-major order (index (z - min_z) * width + (x - min_x)); ids index into names.
+        # Columns with no surface have height min_y - 1 and id 0xffff.
+        region = normalize_region(region)
+        (min_x, min_y, min_z), (max_x, max_y, max_z) = region
+        width = max_x - min_x + 1
+        depth = max_z - min_z + 1
+        ignore = set(ignore)
+
+        heights = array.array("i", [min_y - 1]) * (width * depth)
+        ids = array.array("H", [0xffff]) * (width * depth)
+        names = []
+        name_ids = {}
+
+        columns = collections.defaultdict(list)
+        for block_pos in self.backend.iter_keys(pos_get_mapblock(region[0]), pos_get_mapblock(region[1])):
+            columns[(block_pos[0], block_pos[2])].append(block_pos[1])
+
+        for (block_x, block_z), block_ys in columns.items():
+            # Columns of this block column that lie inside the region, as (local index, output index)
+            unresolved = []
+            for z in range(max(min_z, block_z * 16), min(max_z, block_z * 16 + 15) + 1):
+                for x in range(max(min_x, block_x * 16), min(max_x, block_x * 16 + 15) + 1):
+                    unresolved.append(((z % 16) * 256 + (x % 16), (z - min_z) * width + (x - min_x)))
+
+            # Top-down, stopping as soon as every column has found its surface
+            for block_y in sorted(block_ys, reverse=True):
+                if not unresolved:
+                    break
+                data = self.backend.get_raw((block_x, block_y, block_z))
+                if data is None:
+                    continue
+                try:
+                    param0, _, _, mappings = read_params(data)
+                except Exception:
+                    continue
+
+                ignored_ids = {mapping_id for mapping_id, name in mappings.items() if name in ignore}
+                if len(ignored_ids) == len(mappings) and set(param0) <= ignored_ids:
+                    continue # Nothing but ignored nodes in this block
+
+                top = min(15, max_y - block_y * 16)
+                bottom = max(0, min_y - block_y * 16)
+                still_unresolved = []
+                for column, output in unresolved:
+                    for y in range(top, bottom - 1, -1):
+                        content = param0[column + y * 16]
+                        if content not in ignored_ids:
+                            name = mappings.get(content, "")
+                            if name not in name_ids:
+                                name_ids[name] = len(names)
+                                names.append(name)
+                            heights[output] = block_y * 16 + y
+                            ids[output] = name_ids[name]
+                            break
+                    else:
+                        still_unresolved.append((column, output))
+                unresolved = still_unresolved
+
+        return {"origin": (min_x, min_z), "width": width, "depth": depth, "heights": heights, "ids": ids, "names": names}
+
+    def heightmap(self, region, ignore=("air", "ignore")):
+        return self.surface(region, ignore=ignore)["heights"]
+
+    def relight(self, region, node_defs=None, sunlight=True, verbose=False):
+        # Loads every block of the region, recalculates its lighting and writes it back in one batch.
+        # The ring of blocks around the region is loaded too, so light and sunlight from outside are kept.
+        region = normalize_region(region)
+        min_block = pos_get_mapblock(region[0])
+        max_block = pos_get_mapblock(region[1])
+        mapblocks = {}
+        context = {}
+        for block_pos, data in self.backend.iter_range(tuple(value - 1 for value in min_block), tuple(value + 1 for value in max_block)):
+            if all(min_block[i] <= block_pos[i] <= max_block[i] for i in range(3)):
+                mapblocks[block_pos] = self.parse_mapblock(block_pos, data, verbose=verbose)
+            else:
+                context[block_pos] = self.parse_mapblock(block_pos, data, verbose=verbose)
+        relight(mapblocks, node_defs=node_defs, sunlight=sunlight, context=context)
+        self.set_mapblocks(mapblocks.items())
+        return len(mapblocks)
+
+    def export_schematic(self, region):
+        # Nodes in blocks that do not exist are exported as air that is never placed.
+        # A block that exists but cannot be read raises a ValueError.
+        region = normalize_region(region)
+        (min_x, min_y, min_z), (max_x, max_y, max_z) = region
+        size = (max_x - min_x + 1, max_y - min_y + 1, max_z - min_z + 1)
+        schematic = Schematic(size)
+        schematic.param1 = bytearray([mts_prob_never]) * (size[0] * size[1] * size[2])
+        name_ids = {"air": 0}
+
+        for block_pos, data in self.backend.iter_range(pos_get_mapblock(region[0]), pos_get_mapblock(region[1])):
+            try:
+                param0, _, param2, mappings = read_params(data)
+            except Exception as e:
+                # Exporting it as holes would give a schematic that silently misses part of the region
+                raise ValueError(f"Cannot read MapBlock {block_pos}: {e}") from e
+
+            # Block content IDs -> schematic content IDs
+            translate = {}
+            for mapping_id, name in mappings.items():
+                if name not in name_ids:
+                    name_ids[name] = len(schematic.names)
+                    schematic.names.append(name)
+                translate[mapping_id] = name_ids[name]
+
+            x0 = max(min_x, block_pos[0] * 16)
+            x1 = min(max_x, block_pos[0] * 16 + 15)
+            length = x1 - x0 + 1
+            for z in range(max(min_z, block_pos[2] * 16), min(max_z, block_pos[2] * 16 + 15) + 1):
+                for y in range(max(min_y, block_pos[1] * 16), min(max_y, block_pos[1] * 16 + 15) + 1):
+                    # Copy a whole row along x at a time
+                    block_index = (z % 16) * 256 + (y % 16) * 16 + x0 % 16
+                    schematic_index = ((z - min_z) * size[1] + (y - min_y)) * size[0] + (x0 - min_x)
+                    schematic.param0[schematic_index:schematic_index + length] = array.array("H", [translate.get(content, 0) for content in param0[block_index:block_index + length]])
+                    schematic.param1[schematic_index:schematic_index + length] = bytes([mts_prob_always]) * length
+                    schematic.param2[schematic_index:schematic_index + length] = param2[block_index:block_index + length]
+
+        return schematic
+
+    def place_schematic(self, schematic, pos, rotation=0, force_placement=False, node_defs=None, batch_size=256, verbose=False):
+        # Pastes a Schematic with its minimum corner at pos. Blocks that do not exist yet are created
+        # filled with air. Placed nodes get param1 0, use relight() afterwards to fix the lighting.
+        # As in Luanti, only air and ignore are replaced unless force_placement is set or the node has its force place bit.
+        if isinstance(schematic, (str, os.PathLike)):
+            schematic = Schematic.from_file(schematic)
+        schematic = schematic.rotated(rotation, node_defs=node_defs)
+        size_x, size_y, size_z = schematic.size
+
+        # Each Y slice is placed or skipped once for the whole placement, and skipped slices are
+        # left out so the ones above move down (this is what gives trees their varying height)
+        slices = [
+            y for y, slice_prob in enumerate(schematic.slice_probs)
+            if slice_prob >= mts_prob_always or slice_prob > random.randrange(mts_prob_always)
+        ]
+        if not slices or not size_x or not size_z:
+            return 0
+        region = (tuple(pos), (pos[0] + size_x - 1, pos[1] + len(slices) - 1, pos[2] + size_z - 1))
+
+        # Node dicts are shared between every node with the same content and param2;
+        # NodeList only ever copies them, so sharing is safe
+        interned = {}
+        def node_for(content, param2):
+            key = (content, param2)
+            node = interned.get(key)
+            if node is None:
+                node = {"name": schematic.names[content], "param1": 0, "param2": param2, "metadata": [], "inventory": None, "timers": []}
+                interned[key] = node
+            return node
+
+        ignore_ids = {content for content, name in enumerate(schematic.names) if name == "ignore"}
+        # Every node always placed (probability 127, with or without the force placement bit)
+        always = not schematic.param1.translate(None, bytes([mts_prob_always, mts_prob_always | mts_force_place]))
+        rows = {}
+        min_block = pos_get_mapblock(region[0])
+        max_block = pos_get_mapblock(region[1])
+
+        pending = []
+        placed = 0
+        for block_x in range(min_block[0], max_block[0] + 1):
+            for block_y in range(min_block[1], max_block[1] + 1):
+                for block_z in range(min_block[2], max_block[2] + 1):
+                    block_pos = (block_x, block_y, block_z)
+                    mapblock = self.get_mapblock(block_pos, verbose=verbose)
+                    if mapblock is None:
+                        mapblock = MapBlock(pos=block_pos)
+                        mapblock.data["nodes"] = NodeList(dict(Node().data, name="air"), uniform=True)
+                    node_data = mapblock.get_node_data(copy=False)
+
+                    x0 = max(region[0][0], block_x * 16)
+                    x1 = min(region[1][0], block_x * 16 + 15)
+                    length = x1 - x0 + 1
+                    for z in range(max(region[0][2], block_z * 16), min(region[1][2], block_z * 16 + 15) + 1):
+                        for y in range(max(region[0][1], block_y * 16), min(region[1][1], block_y * 16 + 15) + 1):
+                            block_index = (z % 16) * 256 + (y % 16) * 16 + x0 % 16
+                            schematic_index = ((z - pos[2]) * size_y + slices[y - pos[1]]) * size_x + (x0 - pos[0])
+                            row = range(schematic_index, schematic_index + length)
+
+                            if force_placement and always and not ignore_ids:
+                                # Fast path: the whole row is placed unconditionally, and structures repeat the same rows a lot
+                                key = (schematic.param0[schematic_index:schematic_index + length].tobytes(), bytes(schematic.param2[schematic_index:schematic_index + length]))
+                                row_data = rows.get(key)
+                                if row_data is None:
+                                    row_data = [node_for(schematic.param0[i], schematic.param2[i]) for i in row]
+                                    rows[key] = row_data
+                                node_data[block_index:block_index + length] = row_data
+                                placed += length
+                                continue
+
+                            for offset, i in enumerate(row):
+                                content = schematic.param0[i]
+                                if content in ignore_ids:
+                                    continue
+                                prob = schematic.param1[i] & 0x7f
+                                if prob == mts_prob_never or (prob < mts_prob_always and prob <= random.randrange(mts_prob_always)):
+                                    continue
+                                target = node_data[block_index + offset]
+                                if not (force_placement or schematic.param1[i] & mts_force_place or target["name"] in ("air", "ignore")):
+                                    continue
+                                node_data[block_index + offset] = node_for(content, schematic.param2[i])
+                                placed += 1
+
+                    mapblock.set_node_data(node_data)
+                    pending.append((block_pos, mapblock))
+                    if len(pending) >= batch_size:
+                        self.set_mapblocks(pending)
+                        pending = []
+
+        if pending:
+            self.set_mapblocks(pending)
+        return placed
+
+    def copy_to(self, other, batch_size=256):
+        # Raw copy to another World or Backend, e.g. to export a world to a packed file
+        if isinstance(other, World):
+            other = other.backend
+        count = 0
+        for batch in self.iter_raw_batches(batch_size=batch_size):
+            other.put_many(batch)
+            count += len(batch)
+        return count
+
+    def compact(self, incremental=False, progress=None):
+        self.backend.compact(incremental=incremental, progress=progress)
+
+    def prune(self, mapgen_nodes=None, protected=None, center=None, radius=None, dry_run=False, vacuum=True, incremental=False, batch_size=1024, progress=None):
+        # Deletes blocks that are outside every protected region (a list of inclusive node regions) and:
+        # - with center/radius, whose centre is further than radius nodes (horizontally) from center
+        # - with mapgen_nodes, that contain only those nodes and no metadata, static objects or timers
+        # If both are given a block has to match both. A dry run only reports what would be deleted;
+        # "reclaimable" is the size of the deleted blocks' data, an estimate of the space a vacuum frees.
+        if mapgen_nodes is None and radius is None:
+            raise ValueError("Either mapgen_nodes or radius must be given")
+        if mapgen_nodes is not None:
+            mapgen_nodes = set(mapgen_nodes)
+        protected = [normalize_region(region) for region in (protected or [])]
+        center = center or (0, 0, 0)
+
+        stats = {"phase": "scan", "scanned": 0, "deleted_blocks": 0, "reclaimable": 0, "batch": 0, "dry_run": dry_run}
+
+        def block_protected(pos):
+            block_region = ((pos[0] * 16, pos[1] * 16, pos[2] * 16), (pos[0] * 16 + 15, pos[1] * 16 + 15, pos[2] * 16 + 15))
+            return any(
+                all(block_region[0][i] <= region[1][i] and region[0][i] <= block_region[1][i] for i in range(3))
+                for region in protected
+            )
+
+        # Positions are collected first, so nothing is written while the blocks are still being read
+        doomed = []
+        for batch in self.iter_raw_batches(batch_size=batch_size):
+            for pos, data in batch:
+                if block_protected(pos):
+                    continue
+                if radius is not None and math.hypot(pos[0] * 16 + 8 - center[0], pos[2] * 16 + 8 - center[2]) <= radius:
+                    continue
+                if mapgen_nodes is not None:
+                    try:
+                        if not is_pristine(data, mapgen_nodes):
+                            continue
+                    except Exception:
+                        continue # Blocks that cannot be read are never deleted
+                doomed.append(pos)
+                stats["reclaimable"] += len(data)
+            stats["scanned"] += len(batch)
+            stats["batch"] = len(batch)
+            if progress:
+                progress(stats)
+
+        stats["phase"] = "delete"
+        stats["size_before"] = self.backend.get_size()
+        for i in range(0, len(doomed), batch_size):
+            batch = doomed[i:i + batch_size]
+            if not dry_run:
+                self.backend.delete_many(batch)
+            stats["deleted_blocks"] += len(batch)
+            stats["batch"] = len(batch)
+            if progress:
+                progress(stats)
+
+        if vacuum and not dry_run and doomed:
+            self.compact(incremental=incremental, progress=progress)
+        stats["size_after"] = self.backend.get_size()
+
+        del stats["phase"]
+        del stats["batch"]
+        return stats
 
     def get_all_mapblocks(self):
         mapblocks = []
@@ -971,3 +2489,383 @@ class World:
             mapblocks.append((mapblock[0], mapblock[1], mapblock[2], self.get_mapblock(mapblock)))
 
         return mapblocks
+
+mts_magic = b"MTSM"
+mts_version = 4
+mts_prob_always = 0x7f
+mts_prob_always_old = 0xff
+mts_prob_never = 0x00
+mts_force_place = 0x80
+
+# Rotated facedir for 0, 90, 180 and 270 degrees around the Y axis, as used by Luanti
+rotate_facedir = (
+    0, 1, 2, 3, 1, 2, 3, 0, 2, 3, 0, 1, 3, 0, 1, 2,
+    4, 13, 10, 19, 5, 14, 11, 16, 6, 15, 8, 17, 7, 12, 9, 18,
+    8, 17, 6, 15, 9, 18, 7, 12, 10, 19, 4, 13, 11, 16, 5, 14,
+    12, 9, 18, 7, 13, 10, 19, 4, 14, 11, 16, 5, 15, 8, 17, 6,
+    16, 5, 14, 11, 17, 6, 15, 8, 18, 7, 12, 9, 19, 4, 13, 10,
+    20, 23, 22, 21, 21, 20, 23, 22, 22, 21, 20, 23, 23, 22, 21, 20,
+)
+wallmounted_to_rot = (0, 2, 1, 3)
+rot_to_wallmounted = (2, 4, 3, 5)
+
+def rotate_param2(param2, paramtype2, rot):
+    if paramtype2 in ("facedir", "colorfacedir"):
+        facedir = (param2 & 31) % 24
+        return (param2 & ~31) | rotate_facedir[facedir * 4 + rot]
+    if paramtype2 in ("wallmounted", "colorwallmounted"):
+        face = param2 & 7
+        if face <= 1 or face >= 6:
+            return param2 # Floor and ceiling (6 and 7 are their rotated variants) are not affected by rotating around Y
+        return (param2 & ~7) | rot_to_wallmounted[(wallmounted_to_rot[face - 2] - rot) & 3]
+    return param2
+
+class Schematic:
+    # Luanti .mts schematic. Nodes are stored in flat arrays indexed z * size_y * size_x + y * size_x + x.
+    # param1 is the placement probability (0-127, 0x80 = force placement).
+    def __init__(self, size=(0, 0, 0), names=None, param0=None, param1=None, param2=None, slice_probs=None):
+        self.size = tuple(size)
+        volume = self.size[0] * self.size[1] * self.size[2]
+        self.names = names if names is not None else ["air"]
+        self.param0 = param0 if param0 is not None else array.array("H", [0]) * volume
+        self.param1 = param1 if param1 is not None else bytearray([mts_prob_always]) * volume
+        self.param2 = param2 if param2 is not None else bytearray(volume)
+        self.slice_probs = slice_probs if slice_probs is not None else bytearray([mts_prob_always]) * self.size[1]
+
+    @classmethod
+    def from_file(cls, filename):
+        with open(filename, "rb") as f:
+            return cls.parse(f.read())
+
+    def to_file(self, filename):
+        with open(filename, "wb") as f:
+            f.write(self.serialize())
+
+    @classmethod
+    def parse(cls, data):
+        magic, data = pop_bytes(data, 4)
+        if magic != mts_magic:
+            raise ValueError("Not a Luanti schematic (.mts) file")
+
+        version_bytes, data = pop_bytes(data, 2)
+        version = unpack("u16", version_bytes)
+        if version > mts_version:
+            raise ValueError(f"Unsupported schematic version {version}")
+
+        size_bytes, data = pop_bytes(data, 6)
+        size = struct.unpack(">hhh", size_bytes)
+
+        if version >= 3:
+            slice_probs, data = pop_bytes(data, size[1])
+            slice_probs = bytearray(slice_probs)
+        else:
+            slice_probs = bytearray([0xff]) * size[1]
+
+        num_names_bytes, data = pop_bytes(data, 2)
+        names = []
+        for _ in range(unpack("u16", num_names_bytes)):
+            name_len, data = pop_bytes(data, 2)
+            name, data = pop_bytes(data, unpack("u16", name_len))
+            names.append(name.decode("utf-8"))
+
+        volume = size[0] * size[1] * size[2]
+        node_data = zlib.decompress(data)
+        param0 = array.array("H", unpack_array(2, node_data[:volume * 2]))
+        param1 = bytearray(node_data[volume * 2:volume * 3])
+        param2 = bytearray(node_data[volume * 3:volume * 4])
+
+        if version < 2:
+            # Version 1 had no probabilities, so a param1 of 0 means "always" (0xff before the version 4 shift)
+            param1 = param1.replace(bytes([mts_prob_never]), bytes([mts_prob_always_old]))
+            # "ignore" used to mean "do not place"
+            if "ignore" in names:
+                ignore_id = names.index("ignore")
+                names[ignore_id] = "air"
+                for i in range(volume):
+                    if param0[i] == ignore_id:
+                        param1[i] = mts_prob_never
+
+        if version < 4:
+            # Probabilities used to be 0-255
+            param1 = bytearray(value >> 1 for value in param1)
+            slice_probs = bytearray(value >> 1 for value in slice_probs)
+
+        return cls(size, names, param0, param1, param2, slice_probs)
+
+    def serialize(self):
+        serialized_data = bytearray()
+
+        serialized_data.extend(mts_magic)
+
+        # u16 version
+        serialized_data.extend(pack("u16", mts_version))
+
+        # s16[3] size
+        serialized_data.extend(struct.pack(">hhh", *self.size))
+
+        # u8[size_y] slice probabilities
+        serialized_data.extend(self.slice_probs)
+
+        # u16 name count, then u16 len + name for each
+        serialized_data.extend(pack("u16", len(self.names)))
+        for name in self.names:
+            serialized_data.extend(pack("u16", len(name.encode("utf-8"))))
+            serialized_data.extend(name.encode("utf-8"))
+
+        # zlib-compressed u16 param0, u8 param1 and u8 param2 arrays
+        node_data = pack_array(2, self.param0) + bytes(self.param1) + bytes(self.param2)
+        serialized_data.extend(zlib.compress(node_data))
+
+        return bytes(serialized_data)
+
+    def rotated(self, rotation, node_defs=None):
+        # Rotation in degrees around the Y axis (0, 90, 180 or 270), the same way Luanti rotates schematics.
+        # param2 is rotated for nodes whose node_defs entry has a "paramtype2" of facedir or wallmounted.
+        rot = (rotation // 90) % 4
+        if rot == 0:
+            return self
+
+        size_x, size_y, size_z = self.size
+        if rot % 2:
+            new_size = (size_z, size_y, size_x)
+        else:
+            new_size = self.size
+        new_x, new_y, new_z = new_size
+
+        paramtypes = [(node_defs or {}).get(name, {}).get("paramtype2") for name in self.names]
+
+        volume = size_x * size_y * size_z
+        param0 = array.array("H", [0]) * volume
+        param1 = bytearray(volume)
+        param2 = bytearray(volume)
+        for z in range(new_z):
+            for x in range(new_x):
+                if rot == 1:
+                    source_x, source_z = size_x - 1 - z, x
+                elif rot == 2:
+                    source_x, source_z = size_x - 1 - x, size_z - 1 - z
+                else:
+                    source_x, source_z = z, size_z - 1 - x
+                for y in range(new_y):
+                    i = (z * new_y + y) * new_x + x
+                    source = (source_z * size_y + y) * size_x + source_x
+                    content = self.param0[source]
+                    param0[i] = content
+                    param1[i] = self.param1[source]
+                    param2[i] = rotate_param2(self.param2[source], paramtypes[content], rot)
+
+        return Schematic(new_size, list(self.names), param0, param1, param2, bytearray(self.slice_probs))
+
+light_sun = 15
+light_max = 14
+
+default_node_defs = {
+    "air": {"transparent": True, "sunlight_propagates": True},
+}
+
+relight_directions = {"X-": (-1, 0, 0), "Y-": (0, -1, 0), "Z-": (0, 0, -1), "Z+": (0, 0, 1), "Y+": (0, 1, 0), "X+": (1, 0, 0)}
+
+def relight(mapblocks, node_defs=None, sunlight=True, context=None):
+    # Recalculates param1 (day light in the low nibble, night light in the high nibble) for a region of
+    # loaded MapBlocks, given as {block_pos: MapBlock}. node_defs maps node names to
+    # {"light_source": 0-14, "transparent": bool, "sunlight_propagates": bool}; unknown nodes are opaque.
+    # context is another {block_pos: MapBlock} of neighbouring blocks that are only read: their current
+    # light shines into mapblocks, and a column under a context block only gets sunlight that comes
+    # down through it. Light does not enter or leave through blocks that are in neither.
+    # Faces towards blocks that are not in mapblocks are left marked incomplete, so the server fixes the seams.
+    if not mapblocks:
+        return mapblocks
+    node_defs = dict(default_node_defs, **(node_defs or {}))
+    context = {pos: mapblock for pos, mapblock in (context or {}).items() if pos not in mapblocks}
+    loaded = dict(context)
+    loaded.update(mapblocks)
+
+    min_block = tuple(min(pos[i] for pos in loaded) for i in range(3))
+    max_block = tuple(max(pos[i] for pos in loaded) for i in range(3))
+
+    # One flat array over the bounding box with an opaque border of one node, so neighbours never need bounds checks
+    size_x = (max_block[0] - min_block[0] + 1) * 16 + 2
+    size_y = (max_block[1] - min_block[1] + 1) * 16 + 2
+    size_z = (max_block[2] - min_block[2] + 1) * 16 + 2
+    stride_y = size_x
+    stride_z = size_x * size_y
+    total = size_x * size_y * size_z
+
+    transparent = bytearray(total)
+    propagates = bytearray(total)
+    day = bytearray(total)
+    night = bytearray(total)
+    sources = []
+
+    def base_index(block_pos):
+        return (
+            ((block_pos[2] - min_block[2]) * 16 + 1) * stride_z
+            + ((block_pos[1] - min_block[1]) * 16 + 1) * stride_y
+            + (block_pos[0] - min_block[0]) * 16 + 1
+        )
+
+    def node_offset(index):
+        return (index // 256) * stride_z + ((index // 16) % 16) * stride_y + index % 16
+
+    offsets = [node_offset(index) for index in range(4096)]
+
+    defs = {}
+    for block_pos, mapblock in loaded.items():
+        base = base_index(block_pos)
+        is_context = block_pos in context
+        for index, node in enumerate(mapblock.get_node_data(copy=False)):
+            name = node["name"]
+            if name not in defs:
+                node_def = node_defs.get(name, {})
+                defs[name] = (
+                    bool(node_def.get("transparent")),
+                    bool(node_def.get("sunlight_propagates")),
+                    min(light_max, node_def.get("light_source", 0))
+                )
+            is_transparent, is_propagating, light_source = defs[name]
+            i = base + offsets[index]
+            transparent[i] = is_transparent
+            propagates[i] = is_transparent and is_propagating
+            if is_context:
+                if is_transparent: # The light already stored in context blocks spreads on from there
+                    day[i] = node["param1"] & 0x0f
+                    night[i] = node["param1"] >> 4
+            elif light_source:
+                sources.append((i, light_source))
+
+    # Sunlight falls straight down without losing strength until it hits a node that does not let it through
+    if sunlight:
+        for block_x in range(min_block[0], max_block[0] + 1):
+            for block_z in range(min_block[2], max_block[2] + 1):
+                top = None
+                for block_y in range(max_block[1], min_block[1] - 1, -1):
+                    top = mapblocks.get((block_x, block_y, block_z))
+                    if top is not None:
+                        break
+                if top is None:
+                    continue
+                above = context.get((block_x, block_y + 1, block_z))
+                if above is None and top.data["flags"]["is_underground"]:
+                    continue
+                base = base_index((block_x, block_y, block_z))
+                for column in range(256):
+                    i = base + (column // 16) * stride_z + 15 * stride_y + column % 16
+                    if above is not None and not (propagates[i + stride_y] and day[i + stride_y] == light_sun):
+                        continue # Sunlight only continues down through the block above if it reaches its bottom
+                    while propagates[i]:
+                        day[i] = light_sun
+                        i -= stride_y
+
+    for i, light_source in sources:
+        day[i] = max(day[i], light_source)
+        night[i] = max(night[i], light_source)
+
+    # Flood fill from the brightest nodes down, one bucket per light level, so every node is settled once
+    neighbours = (1, -1, stride_y, -stride_y, stride_z, -stride_z)
+    for light in (day, night):
+        buckets = [[] for _ in range(light_sun + 1)]
+        for i in range(total):
+            if light[i] > 1:
+                buckets[light[i]].append(i)
+        for level in range(light_sun, 1, -1):
+            for i in buckets[level]:
+                if light[i] != level:
+                    continue
+                new_level = level - 1
+                for offset in neighbours:
+                    n = i + offset
+                    if transparent[n] and light[n] < new_level:
+                        light[n] = new_level
+                        buckets[new_level].append(n)
+
+    for block_pos, mapblock in mapblocks.items():
+        base = base_index(block_pos)
+        node_data = mapblock.get_node_data(copy=False)
+        param1 = []
+        for index in range(4096):
+            i = base + offsets[index]
+            if transparent[i]:
+                param1.append(day[i] | (night[i] << 4))
+            else:
+                param1.append(node_data[index]["param1"]) # Opaque nodes may use param1 for something else
+        mapblock.set_param1(param1)
+
+        mapblock.data["flags"]["lighting_expired"] = False
+        for direction, offset in relight_directions.items():
+            neighbour = tuple(block_pos[i] + offset[i] for i in range(3))
+            for bank in ("day", "night"):
+                mapblock.data["lighting_complete"][bank][direction] = neighbour in mapblocks
+
+    return mapblocks
+
+def convert_mapblock(data, level=3):
+    # Blocks that cannot be parsed are copied as they are rather than being lost
+    try:
+        mapblock = MapBlock(data=data, verbose=False)
+        return mapblock.serialize(level=level, verbose=False), True
+    except Exception:
+        return data, False
+
+def save_checkpoint(checkpoint, stats):
+    temp_checkpoint = checkpoint + ".tmp"
+    with open(temp_checkpoint, "w") as f:
+        json.dump(stats, f)
+    os.replace(temp_checkpoint, checkpoint)
+
+def convert_world(src, dst, workers=None, level=3, batch_size=256, checkpoint=None, progress=None):
+    stats = {"done": 0, "converted": 0, "copied": 0}
+    if checkpoint and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            stats.update(json.load(f))
+    resume_from = stats["done"]
+
+    # Parsing is pure Python, so real parallelism needs processes rather than threads
+    executor = None
+    if workers is None or workers > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+    def submit(batch):
+        if executor:
+            return [(pos, executor.submit(convert_mapblock, data, level)) for pos, data in batch]
+        return [(pos, convert_mapblock(data, level)) for pos, data in batch]
+
+    def write(submitted):
+        items = []
+        for pos, result in submitted:
+            data, converted = result.result() if executor else result
+            items.append((pos, data))
+            if converted:
+                stats["converted"] += 1
+            else:
+                stats["copied"] += 1
+        dst.set_mapblocks(items)
+        stats["done"] += len(items)
+        if checkpoint:
+            save_checkpoint(checkpoint, stats)
+        if progress:
+            progress(stats)
+
+    try:
+        seen = 0
+        pending = None
+        for batch in src.iter_raw_batches(batch_size=batch_size):
+            # The source is read in a stable order, so on resume the blocks that were already written are skipped
+            if seen + len(batch) <= resume_from:
+                seen += len(batch)
+                continue
+            skip = max(0, resume_from - seen)
+            seen += len(batch)
+            batch = batch[skip:]
+
+            # Workers convert the next batch while the previous one is being written
+            submitted = submit(batch)
+            if pending:
+                write(pending)
+            pending = submitted
+        if pending:
+            write(pending)
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+
+    return stats
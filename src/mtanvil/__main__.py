@@ -0,0 +1,5 @@
+import sys
+
+from mtanvil.cli import main
+
+sys.exit(main())
@@ -0,0 +1,367 @@
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import sys
+import time
+
+import mtanvil as anvil
+
+def open_world(path, readonly=False, create=False):
+    if os.path.isdir(path): # A Luanti world directory
+        path = os.path.join(path, "map.sqlite")
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            if f.read(len(anvil.packed_magic)) == anvil.packed_magic:
+                return anvil.World.from_packed_file(path, readonly=readonly)
+    elif path.endswith((".mtpk", ".packed")):
+        return anvil.World.from_packed_file(path, readonly=readonly)
+    return anvil.World.from_file(path, readonly=readonly, create=create)
+
+def parse_pos(text):
+    values = tuple(int(value) for value in text.split(","))
+    if len(values) != 3:
+        raise argparse.ArgumentTypeError(f"Expected x,y,z but got {text!r}")
+    return values
+
+def parse_region(text):
+    corners = text.split(":")
+    if len(corners) != 2:
+        raise argparse.ArgumentTypeError(f"Expected x1,y1,z1:x2,y2,z2 but got {text!r}")
+    return anvil.normalize_region((parse_pos(corners[0]), parse_pos(corners[1])))
+
+class Progress:
+    def __init__(self, enabled, label):
+        self.enabled = enabled
+        self.label = label
+        self.count = 0
+        self.start = time.time()
+        self.last = 0
+
+    def update(self, count=1):
+        self.count += count
+        now = time.time()
+        if self.enabled and now - self.last > 0.5:
+            self.last = now
+            rate = self.count / max(now - self.start, 1e-9)
+            print(f"\r{self.label}: {self.count} blocks ({rate:.0f}/s)", end="", file=sys.stderr, flush=True)
+
+    def done(self):
+        if self.enabled:
+            print(f"\r{self.label}: {self.count} blocks in {time.time() - self.start:.1f}s", file=sys.stderr)
+
+def make_executor(jobs):
+    # Parsing is pure Python, so the work is spread over processes
+    if jobs is not None and jobs <= 1:
+        return None
+    return concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+
+def map_batches(executor, func, batches, *args):
+    # Yields (batch, results) while the next batch is already being processed
+    if executor is None:
+        for batch in batches:
+            yield batch, [func(pos, data, *args) for pos, data in batch]
+        return
+
+    pending = None
+    for batch in batches:
+        submitted = (batch, [executor.submit(func, pos, data, *args) for pos, data in batch])
+        if pending:
+            yield pending[0], [future.result() for future in pending[1]]
+        pending = submitted
+    if pending:
+        yield pending[0], [future.result() for future in pending[1]]
+
+def block_stats(pos, data):
+    nodes = collections.Counter()
+    entities = collections.Counter()
+    try:
+        param0, _, _, mappings = anvil.read_params(data)
+        for content, count in collections.Counter(param0).items():
+            nodes[mappings.get(content, "")] += count
+        for static_object in anvil.read_static_objects(data):
+            entities[static_object.entity_name] += 1
+    except Exception:
+        return None
+    return nodes, entities
+
+def replace_in_block(pos, data, old_name, new_name, level, region=None):
+    try:
+        peek = anvil.peek_mapblock(data)
+        if peek is not None and old_name not in peek["name_id_mappings"].values():
+            return None, 0 # Palette check: nothing to replace in this block
+        mapblock = anvil.MapBlock(data=data, verbose=False)
+    except Exception:
+        return None, 0
+
+    indices = range(4096)
+    if region is not None:
+        # Only the nodes of this block that are inside the region
+        low = [max(region[0][i] - pos[i] * 16, 0) for i in range(3)]
+        high = [min(region[1][i] - pos[i] * 16, 15) for i in range(3)]
+        indices = [
+            z * 256 + y * 16 + x
+            for z in range(low[2], high[2] + 1)
+            for y in range(low[1], high[1] + 1)
+            for x in range(low[0], high[0] + 1)
+        ]
+
+    node_data = mapblock.get_node_data(copy=False)
+    replaced = 0
+    for index in indices:
+        node = node_data[index]
+        if node["name"] == old_name:
+            node_data[index] = dict(node, name=new_name)
+            replaced += 1
+    if not replaced:
+        return None, 0
+    mapblock.set_node_data(node_data)
+    return mapblock.serialize(level=level, verbose=False), replaced
+
+def command_stats(args, progress):
+    world = open_world(args.world, readonly=True)
+    nodes = collections.Counter()
+    entities = collections.Counter()
+    blocks = 0
+    unreadable = 0
+
+    executor = make_executor(args.jobs)
+    try:
+        for batch, results in map_batches(executor, block_stats, world.iter_raw_batches()):
+            for result in results:
+                blocks += 1
+                if result is None:
+                    unreadable += 1
+                    continue
+                nodes.update(result[0])
+                entities.update(result[1])
+            progress.update(len(batch))
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+        world.close()
+
+    return {
+        "blocks": blocks, "unreadable_blocks": unreadable,
+        "nodes": dict(nodes.most_common(args.top)), "entities": dict(entities.most_common(args.top))
+    }
+
+def command_find(args, progress):
+    world = open_world(args.world, readonly=True)
+    try:
+        positions = []
+        for pos in world.find_nodes(region=args.region, names=args.name, has_metadata=args.has_metadata, has_timers=args.has_timers):
+            positions.append(pos)
+            if not args.json:
+                print(f"{pos[0]},{pos[1]},{pos[2]}")
+            if args.limit and len(positions) >= args.limit:
+                break
+    finally:
+        world.close()
+    return {"matches": len(positions), "positions": positions}
+
+def command_replace(args, progress):
+    world = open_world(args.world, readonly=args.dry_run)
+    changed_blocks = 0
+    replaced = 0
+
+    # The positions are listed up front so that no query is still reading while the changes are written,
+    # which would keep the database locked against the writes
+    if args.region:
+        positions = list(world.backend.iter_keys(anvil.pos_get_mapblock(args.region[0]), anvil.pos_get_mapblock(args.region[1])))
+    else:
+        positions = list(world.backend.iter_keys())
+    batches = ([(pos, world.backend.get_raw(pos)) for pos in batch] for batch in chunks(positions, 256))
+
+    executor = make_executor(args.jobs)
+    try:
+        for batch, results in map_batches(executor, replace_in_block, batches, args.old_name, args.new_name, args.level, args.region):
+            writes = []
+            for (pos, _), (data, count) in zip(batch, results):
+                if data is not None:
+                    writes.append((pos, data))
+                    replaced += count
+            changed_blocks += len(writes)
+            if writes and not args.dry_run:
+                world.backend.put_many(writes)
+            progress.update(len(batch))
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+        world.close()
+
+    return {"changed_blocks": changed_blocks, "replaced_nodes": replaced, "dry_run": args.dry_run}
+
+def command_prune(args, progress):
+    if args.outside_radius is None and not args.mapgen_nodes:
+        raise SystemExit("prune: --outside-radius or --mapgen-nodes is required")
+    mapgen_nodes = None
+    if args.mapgen_nodes:
+        mapgen_nodes = {name.strip() for names in args.mapgen_nodes for name in names.split(",") if name.strip()}
+
+    world = open_world(args.world, readonly=args.dry_run)
+    def on_progress(stats):
+        if stats["phase"] == "scan":
+            progress.update(stats["batch"])
+    try:
+        return world.prune(
+            mapgen_nodes=mapgen_nodes, protected=args.protect, center=args.center, radius=args.outside_radius,
+            dry_run=args.dry_run, vacuum=not args.no_vacuum, incremental=args.incremental, progress=on_progress
+        )
+    finally:
+        world.close()
+
+def command_copy_region(args, progress):
+    src = open_world(args.src, readonly=True)
+    dst = None if args.dry_run else open_world(args.dst, create=True)
+    copied = 0
+    try:
+        for batch in chunks(src.backend.iter_range(anvil.pos_get_mapblock(args.region[0]), anvil.pos_get_mapblock(args.region[1])), 256):
+            if dst:
+                dst.backend.put_many(batch)
+            copied += len(batch)
+            progress.update(len(batch))
+    finally:
+        src.close()
+        if dst:
+            dst.close()
+    return {"copied_blocks": copied, "dry_run": args.dry_run}
+
+def command_convert(args, progress):
+    src = open_world(args.src, readonly=True)
+    if args.dry_run:
+        blocks = sum(1 for _ in src.list_mapblocks())
+        src.close()
+        return {"blocks": blocks, "dry_run": True}
+
+    dst = open_world(args.dst, create=True)
+    last = [0]
+    def on_progress(stats):
+        progress.update(stats["done"] - last[0])
+        last[0] = stats["done"]
+    try:
+        result = anvil.convert_world(src, dst, workers=args.jobs, level=args.level, checkpoint=args.checkpoint, progress=on_progress)
+    finally:
+        src.close()
+        dst.close()
+    return result
+
+def command_compact(args, progress):
+    world = open_world(args.world, readonly=args.dry_run)
+    try:
+        size_before = world.backend.get_size()
+        if args.dry_run:
+            return {"size": size_before, "dry_run": True}
+        world.compact(incremental=args.incremental)
+        size_after = world.backend.get_size()
+    finally:
+        world.close()
+    return {"size_before": size_before, "size_after": size_after, "reclaimed": size_before - size_after}
+
+def chunks(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def print_summary(summary):
+    for key, value in summary.items():
+        if isinstance(value, dict):
+            print(f"{key}:")
+            for name, count in value.items():
+                print(f"  {name}: {count}")
+        elif isinstance(value, list):
+            continue
+        else:
+            print(f"{key}: {value}")
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--jobs", "-j", type=int, default=None, help="number of worker processes (default: one per CPU)")
+    common.add_argument("--json", action="store_true", help="print the summary as JSON")
+    common.add_argument("--quiet", "-q", action="store_true", help="do not show progress")
+
+    parser = argparse.ArgumentParser(prog="mtanvil", description="Bulk operations on Luanti worlds")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_world(subparser, name="world"):
+        subparser.add_argument(name, help="map.sqlite, packed world file or world directory")
+
+    def add_region(subparser, required=False):
+        subparser.add_argument("--region", type=parse_region, metavar="X1,Y1,Z1:X2,Y2,Z2", required=required, help="inclusive node region (use --region=... if it starts with a minus)")
+
+    stats = subparsers.add_parser("stats", parents=[common], help="count blocks, nodes and entities")
+    add_world(stats)
+    stats.add_argument("--top", type=int, default=50, help="number of node and entity names to list")
+    stats.set_defaults(func=command_stats)
+
+    find = subparsers.add_parser("find", parents=[common], help="find nodes by name, metadata or timers")
+    add_world(find)
+    add_region(find)
+    find.add_argument("--name", action="append", help="node name (can be repeated)")
+    find.add_argument("--has-metadata", action="store_true")
+    find.add_argument("--has-timers", action="store_true")
+    find.add_argument("--limit", type=int, default=0, help="stop after this many matches")
+    find.set_defaults(func=command_find)
+
+    replace = subparsers.add_parser("replace", parents=[common], help="replace one node name with another")
+    add_world(replace)
+    replace.add_argument("old_name")
+    replace.add_argument("new_name")
+    add_region(replace)
+    replace.add_argument("--level", type=int, default=3, help="zstd compression level")
+    replace.add_argument("--dry-run", action="store_true")
+    replace.set_defaults(func=command_replace)
+
+    prune = subparsers.add_parser("prune", parents=[common], help="delete blocks outside a radius or that were never changed")
+    add_world(prune)
+    prune.add_argument("--outside-radius", type=int, help="horizontal radius in nodes")
+    prune.add_argument("--center", type=parse_pos, default=(0, 0, 0), metavar="X,Y,Z")
+    prune.add_argument("--mapgen-nodes", action="append", metavar="NAME[,NAME...]", help="only delete blocks made of these nodes with no metadata, objects or timers (can be repeated)")
+    prune.add_argument("--protect", type=parse_region, action="append", metavar="X1,Y1,Z1:X2,Y2,Z2", help="inclusive node region that is never pruned (can be repeated)")
+    prune.add_argument("--no-vacuum", action="store_true", help="do not compact the world file afterwards")
+    prune.add_argument("--incremental", action="store_true", help="use incremental vacuum if the database supports it")
+    prune.add_argument("--dry-run", action="store_true", help="only report what would be deleted and how much space that is")
+    prune.set_defaults(func=command_prune)
+
+    copy_region = subparsers.add_parser("copy-region", parents=[common], help="copy every block that overlaps a region to another world (whole blocks, not clipped to the region)")
+    add_world(copy_region, "src")
+    add_world(copy_region, "dst")
+    add_region(copy_region, required=True)
+    copy_region.add_argument("--dry-run", action="store_true")
+    copy_region.set_defaults(func=command_copy_region)
+
+    convert = subparsers.add_parser("convert", parents=[common], help="re-serialize every block as format 29 into another world")
+    add_world(convert, "src")
+    add_world(convert, "dst")
+    convert.add_argument("--level", type=int, default=3, help="zstd compression level")
+    convert.add_argument("--checkpoint", help="file to save progress to, so the conversion can be resumed")
+    convert.add_argument("--dry-run", action="store_true")
+    convert.set_defaults(func=command_convert)
+
+    for name in ("compact", "vacuum"):
+        compact = subparsers.add_parser(name, parents=[common], help="reclaim unused space in the world file")
+        add_world(compact)
+        compact.add_argument("--incremental", action="store_true", help="use incremental vacuum if the database supports it")
+        compact.add_argument("--dry-run", action="store_true")
+        compact.set_defaults(func=command_compact)
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    progress = Progress(not args.quiet and sys.stderr.isatty(), args.command)
+    summary = args.func(args, progress)
+    progress.done()
+
+    if args.json:
+        json.dump(summary, sys.stdout)
+        print()
+    else:
+        print_summary(summary)
+    return 0
@@ -0,0 +1,20 @@
+import pytest
+
+import mtanvil
+
+def test_incomplete_backend_cannot_be_created():
+    class IncompleteBackend(mtanvil.Backend):
+        def get_raw(self, pos):
+            return None
+
+    with pytest.raises(TypeError):
+        IncompleteBackend()
+
+def test_sqlite_round_trip(tmp_path):
+    world = mtanvil.World.from_file(str(tmp_path / "map.sqlite"), create=True)
+    world.backend.put_many([((x, 0, 0), bytes([x + 5]) * 10) for x in range(-5, 5)])
+    world.backend.delete_raw((4, 0, 0))
+    assert sorted(world.backend.iter_keys()) == [(x, 0, 0) for x in range(-5, 4)]
+    assert dict(world.backend.iter_range((-1, 0, 0), (1, 0, 0))) == {(x, 0, 0): bytes([x + 5]) * 10 for x in (-1, 0, 1)}
+    assert sum(len(batch) for batch in world.iter_raw_batches(batch_size=4)) == 9
+    world.close()
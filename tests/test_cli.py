@@ -0,0 +1,45 @@
+import json
+
+import mtanvil
+from mtanvil import cli
+
+def make_block(name):
+    mapblock = mtanvil.MapBlock()
+    mapblock.data["nodes"] = mtanvil.NodeList(dict(mtanvil.Node().data, name=name), uniform=True)
+    return mapblock.serialize(verbose=False)
+
+def run(capsys, *argv):
+    assert cli.main(list(argv) + ["--json", "--quiet"]) == 0
+    return json.loads(capsys.readouterr().out)
+
+def test_replace_whole_world(tmp_path, capsys):
+    # More blocks than the reader prefetches, with changes spread through the world
+    filename = str(tmp_path / "map.sqlite")
+    world = mtanvil.World.from_file(filename, create=True)
+    air = make_block("air")
+    stone = make_block("default:stone")
+    world.backend.put_many([((x, y, z), stone if x % 10 == 0 else air) for x in range(30) for y in range(10) for z in range(10)])
+    world.close()
+
+    summary = run(capsys, "replace", filename, "default:stone", "default:dirt", "-j", "1")
+    assert summary["changed_blocks"] == 300
+    assert summary["replaced_nodes"] == 300 * 4096
+
+    world = mtanvil.World.from_file(filename, readonly=True)
+    assert world.get_mapblock((20, 9, 9), verbose=False).get_node((0, 0, 0)).data["name"] == "default:dirt"
+    world.close()
+
+def test_replace_region(tmp_path, capsys):
+    filename = str(tmp_path / "map.sqlite")
+    world = mtanvil.World.from_file(filename, create=True)
+    world.backend.put_many([((0, 0, 0), make_block("default:stone")), ((1, 0, 0), make_block("default:stone"))])
+    world.close()
+
+    summary = run(capsys, "replace", filename, "default:stone", "default:dirt", "--region=15,0,0:16,0,0", "-j", "1")
+    assert summary["replaced_nodes"] == 2
+
+    world = mtanvil.World.from_file(filename, readonly=True)
+    names = [node["name"] for node in world.get_mapblock((0, 0, 0), verbose=False).get_node_data(copy=False)]
+    assert names.count("default:dirt") == 1
+    assert names[15] == "default:dirt"
+    world.close()
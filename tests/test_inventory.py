@@ -0,0 +1,76 @@
+import mtanvil
+
+CHEST_INVENTORY = (
+    b"List main 3\n"
+    b"Width 0\n"
+    b"Item default:cobble 99\n"
+    b"Empty\n"
+    b"Item default:pick_steel 1 1200 \"\\u0001description\\u0002Sharp\\u0003\"\n"
+    b"EndInventoryList\n"
+    b"List fuel 1\n"
+    b"Width 0\n"
+    b"Empty\n"
+    b"EndInventoryList\n"
+    b"EndInventory\n"
+)
+
+# Older worlds close lists and the inventory with "end"
+OLD_INVENTORY = (
+    b"List main 1\n"
+    b"Width 0\n"
+    b"Item default:dirt 5\n"
+    b"end\n"
+    b"List craft 1\n"
+    b"Width 0\n"
+    b"Empty\n"
+    b"end\n"
+    b"end\n"
+)
+
+def test_itemstack_round_trip():
+    for itemstring in ["default:dirt", "default:dirt 5", "default:pick_steel 1 1200", "default:pick_steel 1 0 \"\\u0001a\\u0002b c\\u0003\""]:
+        assert mtanvil.ItemStack.from_string(itemstring).to_string() == itemstring
+
+    stack = mtanvil.ItemStack.from_string("default:pick_steel 1 1200")
+    assert (stack.name, stack.count, stack.wear) == ("default:pick_steel", 1, 1200)
+
+def test_inventory_round_trip():
+    inventory = mtanvil.Inventory(CHEST_INVENTORY)
+    assert inventory.serialize() == CHEST_INVENTORY
+
+    main = inventory.get_list("main")
+    assert main.size == 3
+    assert main.items[0].to_string() == "default:cobble 99"
+    assert main.items[1] is None
+    assert main.items[2].wear == 1200
+    assert inventory.serialize() == CHEST_INVENTORY
+    assert not inventory.is_empty()
+    assert mtanvil.Inventory(b"EndInventory\n").is_empty()
+
+def test_find_inventory_end():
+    data = CHEST_INVENTORY + b"rest of the block"
+    assert mtanvil.find_inventory_end(data) == len(CHEST_INVENTORY)
+
+def test_find_inventory_end_with_end_lines():
+    data = OLD_INVENTORY + b"rest of the block"
+    assert mtanvil.find_inventory_end(data) == len(OLD_INVENTORY)
+    assert sorted(mtanvil.Inventory(OLD_INVENTORY).lists) == ["craft", "main"]
+
+def test_metadata_inventory_in_mapblock():
+    mapblock = mtanvil.MapBlock()
+    mapblock.data["nodes"] = mtanvil.NodeList(dict(mtanvil.Node().data, name="air"), uniform=True)
+    for pos, raw in (((0, 0, 0), OLD_INVENTORY), ((1, 0, 0), CHEST_INVENTORY)):
+        node = mtanvil.Node({
+            "name": "default:chest", "param1": 0, "param2": 0,
+            "metadata": [{"key": "infotext", "value": "Chest", "is_private": False}],
+            "inventory": mtanvil.Inventory(raw), "timers": []
+        })
+        mapblock.set_node(pos, node)
+    mapblock.data["static_objects"] = [mtanvil.StaticObject(7, (1.5, 2.5, 3.5), b"")]
+    data = mapblock.serialize(verbose=False)
+
+    parsed = mtanvil.MapBlock(data=data, verbose=False)
+    assert parsed.serialize(verbose=False) == data # Inventories that were not looked at are written back untouched
+    assert parsed.get_node((0, 0, 0)).data["inventory"].get_list("main").items[0].to_string() == "default:dirt 5"
+    assert parsed.get_node((1, 0, 0)).data["inventory"].get_list("main").items[0].to_string() == "default:cobble 99"
+    assert [static_object.pos for static_object in mtanvil.read_static_objects(data)] == [(1.5, 2.5, 3.5)]
@@ -0,0 +1,34 @@
+import mtanvil
+
+def make_block(name="default:stone"):
+    mapblock = mtanvil.MapBlock()
+    mapblock.data["nodes"] = mtanvil.NodeList(dict(mtanvil.Node().data, name=name), uniform=True)
+    return mapblock
+
+def test_serialize_round_trip():
+    mapblock = make_block()
+    mapblock.set_node((1, 2, 3), mtanvil.Node({"name": "default:dirt", "param1": 15, "param2": 3, "metadata": [], "timers": []}))
+    data = mapblock.serialize(verbose=False)
+
+    parsed = mtanvil.MapBlock(data=data, verbose=False)
+    assert parsed.get_node((1, 2, 3)).data["name"] == "default:dirt"
+    assert parsed.get_node((1, 2, 3)).data["param2"] == 3
+    assert parsed.get_node((0, 0, 0)).data["name"] == "default:stone"
+    assert parsed.serialize(verbose=False) == data
+
+def test_fixed_point_values_survive_conversion():
+    # 3 / 10000 * 10000 and 1.001 * 1000 are both just below the integer in floating point
+    mapblock = make_block()
+    mapblock.data["static_objects"] = [mtanvil.StaticObject(7, (0.0003, -0.0006, 0.0029), b"")]
+    mapblock.set_node((0, 0, 0), mtanvil.Node({
+        "name": "default:furnace", "param1": 0, "param2": 0, "metadata": [],
+        "timers": [{"timeout": 1.001, "elapsed": 1.003}]
+    }))
+    data = mapblock.serialize(verbose=False)
+
+    converted, was_converted = mtanvil.convert_mapblock(data)
+    assert was_converted
+    assert converted == data
+    parsed = mtanvil.MapBlock(data=converted, verbose=False)
+    assert parsed.data["static_objects"][0].pos == (0.0003, -0.0006, 0.0029)
+    assert parsed.data["timers"][0]["timeout"] == 1.001
@@ -0,0 +1,48 @@
+import mtanvil
+
+def make_data():
+    mapblock = mtanvil.MapBlock()
+    mapblock.data["nodes"] = mtanvil.NodeList(dict(mtanvil.Node().data, name="default:stone"), uniform=True)
+    mapblock.set_node((1, 0, 0), mtanvil.Node({"name": "default:dirt", "param1": 0, "param2": 0, "metadata": [], "timers": []}))
+    return mapblock.serialize(verbose=False)
+
+def test_uniform_block():
+    node_list = mtanvil.NodeList(dict(mtanvil.Node().data, name="air"), uniform=True)
+    assert node_list.is_uniform()
+    node_list[5].set_name("default:dirt")
+    assert not node_list.is_uniform()
+    assert node_list.node_data()[5]["name"] == "default:dirt"
+    assert node_list.node_data()[4]["name"] == "air"
+    assert node_list.base["name"] == "air"
+
+def test_copy_does_not_share_changes():
+    mapblock = mtanvil.MapBlock(data=make_data(), verbose=False)
+    copied = mapblock.copy()
+    copied.get_node((0, 0, 0)).set_name("default:glass")
+    copied.get_node((1, 0, 0)).data["metadata"].append({"key": "a", "value": "b", "is_private": False})
+    assert mapblock.get_node((0, 0, 0)).data["name"] == "default:stone"
+    assert mapblock.get_node((1, 0, 0)).data["metadata"] == []
+
+def test_get_node_data_returns_copies():
+    cache = mtanvil.MapBlockCache()
+    data = make_data()
+    node_data = cache.get((0, 0, 0), data, verbose=False).get_node_data()
+    node_data[0]["name"] = "mutated"
+    node_data[1]["metadata"].append({"key": "a", "value": "b", "is_private": False})
+
+    mapblock = cache.get((0, 0, 0), data, verbose=False)
+    assert mapblock.get_node((0, 0, 0)).data["name"] == "default:stone"
+    assert mapblock.get_node_data()[1]["metadata"] == []
+
+def test_set_node_data():
+    cache = mtanvil.MapBlockCache()
+    data = make_data()
+    mapblock = cache.get((0, 0, 0), data, verbose=False)
+    node_data = mapblock.get_node_data()
+    node_data[0]["name"] = "default:glass"
+    mapblock.set_node_data(node_data)
+
+    assert mapblock.get_node((0, 0, 0)).data["name"] == "default:glass"
+    assert cache.get((0, 0, 0), data, verbose=False).get_node((0, 0, 0)).data["name"] == "default:stone"
+    parsed = mtanvil.MapBlock(data=mapblock.serialize(verbose=False), verbose=False)
+    assert [parsed.get_node(pos).data["name"] for pos in ((0, 0, 0), (1, 0, 0), (2, 0, 0))] == ["default:glass", "default:dirt", "default:stone"]
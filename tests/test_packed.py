@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+import mtanvil
+
+def test_round_trip(tmp_path):
+    filename = str(tmp_path / "world.mtpk")
+    backend = mtanvil.PackedFileBackend(filename)
+    backend.put_many([((0, 0, 0), b"first"), ((-1, 2, -3), b"second")])
+    backend.put_raw((0, 0, 0), b"replaced")
+    backend.put_raw((5, 5, 5), b"deleted")
+    backend.delete_raw((5, 5, 5))
+    backend.close()
+
+    backend = mtanvil.PackedFileBackend(filename, readonly=True)
+    assert sorted(backend.iter_keys()) == [(-1, 2, -3), (0, 0, 0)]
+    assert backend.get_raw((0, 0, 0)) == b"replaced"
+    assert backend.get_raw((-1, 2, -3)) == b"second"
+    assert backend.get_raw((5, 5, 5)) is None
+    assert dict(backend.iter_range((-1, 0, -3), (0, 2, 0))) == {(-1, 2, -3): b"second", (0, 0, 0): b"replaced"}
+    backend.close()
+
+def test_compact_keeps_newest_records(tmp_path):
+    filename = str(tmp_path / "world.mtpk")
+    backend = mtanvil.PackedFileBackend(filename)
+    for i in range(10):
+        backend.put_raw((0, 0, 0), bytes([i]) * 100)
+    backend.put_raw((1, 0, 0), b"kept")
+    size_before = backend.get_size()
+    backend.compact()
+    assert backend.get_size() < size_before
+    assert backend.get_raw((0, 0, 0)) == bytes([9]) * 100
+    assert backend.get_raw((1, 0, 0)) == b"kept"
+    backend.close()
+
+@pytest.mark.parametrize("cut", [3, 10, 50])
+def test_truncated_record_is_dropped(tmp_path, cut):
+    # cut 3 leaves part of the data, 50 part of the header of the last record
+    filename = str(tmp_path / "world.mtpk")
+    backend = mtanvil.PackedFileBackend(filename)
+    backend.put_raw((1, 1, 1), b"a" * 20)
+    backend.put_raw((2, 2, 2), b"b" * 40)
+    backend.close()
+    os.truncate(filename, os.path.getsize(filename) - cut)
+
+    backend = mtanvil.PackedFileBackend(filename)
+    assert sorted(backend.iter_keys()) == [(1, 1, 1)]
+    backend.put_raw((3, 3, 3), b"c" * 10)
+    backend.put_raw((4, 4, 4), b"d" * 10)
+    backend.close()
+
+    backend = mtanvil.PackedFileBackend(filename, readonly=True)
+    assert sorted(backend.iter_keys()) == [(1, 1, 1), (3, 3, 3), (4, 4, 4)]
+    assert backend.get_raw((1, 1, 1)) == b"a" * 20
+    assert backend.get_raw((3, 3, 3)) == b"c" * 10
+    assert backend.get_raw((4, 4, 4)) == b"d" * 10
+    assert backend.get_size() == os.path.getsize(filename)
+    backend.close()
+
+def test_readonly_does_not_truncate(tmp_path):
+    filename = str(tmp_path / "world.mtpk")
+    backend = mtanvil.PackedFileBackend(filename)
+    backend.put_raw((1, 1, 1), b"a" * 20)
+    backend.close()
+    os.truncate(filename, os.path.getsize(filename) - 5)
+    size = os.path.getsize(filename)
+
+    backend = mtanvil.PackedFileBackend(filename, readonly=True)
+    assert list(backend.iter_keys()) == []
+    with pytest.raises(ValueError):
+        backend.put_raw((2, 2, 2), b"b")
+    backend.close()
+    assert os.path.getsize(filename) == size
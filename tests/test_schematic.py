@@ -0,0 +1,107 @@
+import array
+import random
+import struct
+import zlib
+
+import pytest
+
+import mtanvil
+
+def make_schematic(size=(3, 4, 2)):
+    volume = size[0] * size[1] * size[2]
+    return mtanvil.Schematic(
+        size, ["air", "default:stone", "default:torch"],
+        array.array("H", [i % 3 for i in range(volume)]),
+        bytearray([mtanvil.mts_prob_always]) * volume,
+        bytearray(i % 24 for i in range(volume))
+    )
+
+def test_round_trip():
+    schematic = make_schematic()
+    schematic.param1[0] = 64 | mtanvil.mts_force_place
+    schematic.slice_probs[1] = 50
+    parsed = mtanvil.Schematic.parse(schematic.serialize())
+    assert parsed.size == schematic.size
+    assert parsed.names == schematic.names
+    assert parsed.param0 == schematic.param0
+    assert parsed.param1 == schematic.param1
+    assert parsed.param2 == schematic.param2
+    assert parsed.slice_probs == schematic.slice_probs
+    assert parsed.serialize() == schematic.serialize()
+
+def test_version_1_probabilities():
+    # Version 1 had no probabilities (param1 0 means always) and "ignore" meant "do not place"
+    names = [b"default:stone", b"ignore"]
+    header = struct.pack(">4sHhhhH", b"MTSM", 1, 2, 1, 1, len(names)) + b"".join(struct.pack(">H", len(name)) + name for name in names)
+    node_data = struct.pack(">HH", 0, 1) + bytes([0, 0]) + bytes([0, 0])
+    schematic = mtanvil.Schematic.parse(header + zlib.compress(node_data))
+    assert schematic.names == ["default:stone", "air"]
+    assert list(schematic.param1) == [mtanvil.mts_prob_always, mtanvil.mts_prob_never]
+
+def test_rotate_param2():
+    assert [mtanvil.rotate_param2(facedir, "facedir", 1) for facedir in range(4)] == [1, 2, 3, 0]
+    assert mtanvil.rotate_param2(7, None, 1) == 7
+    assert mtanvil.rotate_param2(1, "wallmounted", 1) == 1 # Ceiling
+    assert mtanvil.rotate_param2(6, "wallmounted", 1) == 6 # Rotated floor
+    for paramtype2, values in (("facedir", range(24)), ("wallmounted", range(6)), ("colorfacedir", (5, 37, 229))):
+        for value in values:
+            rotated = value
+            for rot in range(4):
+                assert mtanvil.rotate_param2(value, paramtype2, rot) == rotated
+                rotated = mtanvil.rotate_param2(rotated, paramtype2, 1)
+            assert rotated == value
+
+def test_rotated_four_times_is_unchanged():
+    schematic = make_schematic()
+    node_defs = {"default:torch": {"paramtype2": "wallmounted"}, "default:stone": {"paramtype2": "facedir"}}
+    rotated = schematic.rotated(90, node_defs)
+    assert rotated.size == (2, 4, 3)
+    for _ in range(3):
+        rotated = rotated.rotated(90, node_defs)
+    assert rotated.param0 == schematic.param0
+    assert rotated.param2 == schematic.param2
+
+@pytest.fixture
+def world(tmp_path):
+    world = mtanvil.World.from_file(str(tmp_path / "map.sqlite"), create=True)
+    yield world
+    world.close()
+
+def test_export_and_place(world):
+    schematic = make_schematic()
+    placed = world.place_schematic(schematic, (10, 14, -3))
+    assert placed == 3 * 4 * 2
+    exported = world.export_schematic(((10, 14, -3), (12, 17, -2)))
+    assert exported.size == schematic.size
+    assert [exported.names[content] for content in exported.param0] == [schematic.names[content] for content in schematic.param0]
+    assert exported.param2 == schematic.param2
+
+def test_slices_are_decided_once(world):
+    # Slice 1 is skipped or placed as a whole, and when it is skipped the slices above move down
+    size = (20, 3, 20)
+    volume = size[0] * size[1] * size[2]
+    schematic = mtanvil.Schematic(
+        size, ["default:stone", "default:dirt", "default:wood"],
+        array.array("H", [(i // size[0]) % size[1] for i in range(volume)]),
+        bytearray([mtanvil.mts_prob_always]) * volume, bytearray(volume),
+        bytearray([mtanvil.mts_prob_always, 64, mtanvil.mts_prob_always])
+    )
+    random.seed(1)
+    results = set()
+    for i in range(6):
+        origin = (i * 32, 0, 0)
+        world.place_schematic(schematic, origin)
+        exported = world.export_schematic((origin, (origin[0] + 19, 2, 19)))
+        layers = []
+        for y in range(3):
+            names = {exported.names[exported.param0[(z * 3 + y) * 20 + x]] for z in range(20) for x in range(20)}
+            assert len(names) == 1
+            layers.append(names.pop())
+        results.add(tuple(layers))
+    assert results == {("default:stone", "default:dirt", "default:wood"), ("default:stone", "default:wood", "air")}
+
+def test_export_unreadable_block(world):
+    world.backend.put_raw((0, 0, 0), b"\x1dnot a mapblock")
+    with pytest.raises(ValueError):
+        world.export_schematic(((0, 0, 0), (3, 3, 3)))
+    assert world.export_schematic(((16, 0, 0), (19, 3, 3))).param1 == bytearray([mtanvil.mts_prob_never]) * 64